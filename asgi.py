@@ -0,0 +1,11 @@
+from flaskblog import create_app
+from flaskblog.asgi import to_asgi
+
+# production entry point for ASGI servers, run from the project directory:
+#     pip install asgiref "uvicorn[standard]"     # [standard] brings the faster httptools parser and uvloop
+#     uvicorn asgi:app --workers 4
+# or, for the plain WSGI version of the same app:
+#     gunicorn run:app --workers 4
+# pick --workers by cores; each worker serves up to ASGI_THREADS requests at once (see flaskblog/asgi.py)
+
+app = to_asgi(create_app())
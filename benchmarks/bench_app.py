@@ -0,0 +1,339 @@
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# load test for the main, posts and users blueprints
+# seeds a throwaway database, then times each scenario below against the real create_app()
+#     python benchmarks/bench_app.py --users 100 --posts 20000 --output before.json
+#     python benchmarks/bench_app.py --server --workers 4 --concurrency 8     # through gunicorn (or werkzeug)
+#     python benchmarks/bench_app.py --server asgi --workers 4 --concurrency 8 --compare wsgi.json   # through uvicorn
+#     python benchmarks/bench_app.py --compare before.json --output after.json
+# with --compare it exits with status 1 if a scenario got slower than --max-regression allows,
+# or if it now issues more queries per request than before
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'benchmark'
+WRITER = 'bench_writer'
+
+def make_app():
+    # the app under test; also what gunicorn imports in --server mode
+    sys.path.insert(0, ROOT)
+    from flaskblog import create_app
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False  # the benchmark posts forms without fetching them first
+    return app
+
+def make_asgi_app():
+    # the same app behind flaskblog/asgi.py's adapter, for uvicorn in --server asgi mode
+    from flaskblog.asgi import to_asgi
+    return to_asgi(make_app())
+
+def seed(app, users, posts, batch_size=10000):
+    from flaskblog import db, hasher
+    from flaskblog.models import Post, User, summarize
+    rng = random.Random(42)
+    with app.app_context():
+        db.create_all()
+        password = hasher.hash(PASSWORD)    # one hash shared by everyone; hashing per user would dominate seeding
+        names = [WRITER] + [f'user{n}' for n in range(users - 1)]
+        db.session.execute(User.__table__.insert(),
+                           [{'username': name, 'email': f'{name}@example.com', 'password': password} for name in names])
+        start = datetime.utcnow() - timedelta(minutes=posts)
+        for offset in range(0, posts, batch_size):
+            rows = []
+            for n in range(offset, min(offset + batch_size, posts)):
+                content = ' '.join(rng.choices(WORDS, k=rng.randint(20, 200)))
+                excerpt, word_count, reading_time = summarize(content)  # what Post's validator would have filled in
+                rows.append({'title': f'Post {n}', 'content': content, 'date_posted': start + timedelta(minutes=n),
+                             'user_id': rng.randint(1, users), 'excerpt': excerpt, 'word_count': word_count,
+                             'reading_time': reading_time})
+            db.session.execute(Post.__table__.insert(), rows)
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()     # the server processes open their own connections
+    return names
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore '
+         'magna aliqua flask blog post python database query cache page feed').split()
+
+class ClientSession:
+    # one visitor going through the WSGI test client, in this process
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None     # we time single requests, so a 302 is an answer, not something to follow
+
+class HTTPSession:
+    # one visitor talking to the server over HTTP, with its own cookies
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                                  _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+def scenarios(app, names, posts, per_page):
+    # name -> (needs a logged-in writer?, function(rng) returning (method, path, form data))
+    from flaskblog import db
+    from flaskblog.models import Post
+    from flaskblog.pagination import encode_cursor
+    last_page = max(1, (posts + per_page - 1) // per_page)
+    written = []    # ids of the posts the writer creates, for the update and delete scenarios
+
+    with app.test_request_context():
+        # in keyset mode there are no page numbers, so a deep page is the cursor of a post far down the feed
+        deep = Post.query.order_by(Post.date_posted.desc(), Post.id.desc()).offset(max(0, posts - per_page * 2)).first()
+        deep_cursor = encode_cursor(deep, 'next') if deep else ''
+        db.session.remove()
+
+    def deep_page(rng):
+        if app.config['FEED_PAGINATION'] == 'keyset':
+            return 'GET', f'/home?cursor={deep_cursor}', None
+        return 'GET', f'/home?page={rng.randint(max(1, last_page - 10), last_page)}', None
+
+    def load_written():
+        with app.app_context():
+            written[:] = [post_id for post_id, in db.session.query(Post.id)
+                          .filter(Post.user_id == 1, Post.title == 'Benchmark post')]
+            db.session.remove()
+
+    def update(rng):
+        if not written:
+            load_written()
+        return 'POST', f'/post/{rng.choice(written)}/update', {'title': 'Benchmark post', 'content': 'edited'}
+
+    def delete(rng):
+        if not written:
+            load_written()
+        return 'POST', f'/post/{written.pop()}/delete', None
+
+    return {
+        'home_shallow': (False, lambda rng: ('GET', f'/home?page={rng.randint(1, 3)}', None)),
+        'home_deep': (False, deep_page),
+        'post_view': (False, lambda rng: ('GET', f'/post/{rng.randint(1, posts)}', None)),
+        'user_feed': (False, lambda rng: ('GET', f'/user/{rng.choice(names)}', None)),
+        'login': (False, lambda rng: ('POST', '/login', {'email': f'{rng.choice(names)}@example.com',
+                                                         'password': PASSWORD})),
+        'post_create': (True, lambda rng: ('POST', '/post/new', {'title': 'Benchmark post', 'content': 'benchmark'})),
+        'post_update': (True, update),
+        'post_delete': (True, delete),
+        'feed_atom': (False, lambda rng: ('GET', '/feed.atom', None)),
+    }
+
+def run_scenario(name, make_request, new_session, needs_writer, requests, concurrency, count_queries, warmup=10):
+    local = threading.local()
+    timings, statuses, queries = [], [], []
+    lock = threading.Lock()
+
+    def one(n):
+        rng = random.Random(n)
+        if not hasattr(local, 'session') or name == 'login':
+            # a login needs a visitor without a session cookie (logged-in users are just redirected)
+            local.session = new_session()
+            if needs_writer:
+                local.session.request('POST', '/login', {'email': f'{WRITER}@example.com', 'password': PASSWORD})
+        method, path, data = make_request(rng)
+        if count_queries:
+            from flaskblog.querycount import QueryCounter
+            with QueryCounter() as counter:
+                started = time.perf_counter()
+                status = local.session.request(method, path, data)
+                elapsed = time.perf_counter() - started
+        else:
+            started = time.perf_counter()
+            status = local.session.request(method, path, data)
+            elapsed = time.perf_counter() - started
+        if n < 0:
+            return      # warm-up request: fills connection pools and lets each server worker import everything
+        with lock:
+            timings.append(elapsed * 1000)
+            statuses.append(status)
+            if count_queries:
+                queries.append(counter.count)
+
+    if concurrency == 1:
+        for n in range(-warmup, 0):
+            one(n)
+        started = time.perf_counter()
+        for n in range(requests):
+            one(n)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(-warmup, 0)))
+            started = time.perf_counter()
+            list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    timings.sort()
+    return {
+        'requests': requests,
+        'errors': sum(1 for status in statuses if status >= 400),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'throughput_rps': round(requests / wall, 1),
+        'queries_per_request': round(statistics.mean(queries), 2) if queries else None,
+    }
+
+def percentile(sorted_values, p):
+    return sorted_values[max(0, int(len(sorted_values) * p / 100) - 1)]
+
+def start_server(workers, port, interface='wsgi'):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    here = os.path.dirname(os.path.abspath(__file__))
+    if interface == 'asgi':
+        try:
+            import uvicorn, asgiref     # noqa: F401
+        except ImportError:
+            raise SystemExit('--server asgi needs uvicorn and asgiref (pip install uvicorn asgiref)')
+        # uvicorn's --workers are processes, like gunicorn's, so the same --workers means the same cores
+        command = [sys.executable, '-m', 'uvicorn', '--factory', 'bench_app:make_asgi_app', '--workers', str(workers),
+                   '--host', '127.0.0.1', '--port', str(port), '--app-dir', here, '--log-level', 'warning',
+                   '--no-access-log']
+    else:
+        try:
+            import gunicorn     # noqa: F401
+            command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+                       '--chdir', here, '--log-level', 'warning', 'bench_app:make_app()']
+        except ImportError:
+            # werkzeug forks a process per request; not a real worker pool, but it does use several cores
+            command = [sys.executable, os.path.abspath(__file__), '--serve', str(port), '--workers', str(workers)]
+    server = subprocess.Popen(command, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('the benchmark server did not start')
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def compare(results, baseline, max_regression):
+    # prints a before/after table and returns the scenarios that regressed
+    regressions = []
+    print(f'{"scenario":<14} {"p95 before":>11} {"p95 after":>10} {"change":>8}  queries')
+    for name, after in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        change = after['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+        queries = f"{before['queries_per_request']} -> {after['queries_per_request']}"
+        print(f"{name:<14} {before['p95_ms']:>9.2f}ms {after['p95_ms']:>8.2f}ms {change:>+7.0%}  {queries}")
+        if change > max_regression:
+            regressions.append(f'{name}: p95 {change:+.0%}')
+        if None not in (before['queries_per_request'], after['queries_per_request']) \
+                and after['queries_per_request'] > before['queries_per_request']:
+            regressions.append(f'{name}: {queries} queries per request')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed requests before each scenario')
+    parser.add_argument('--only', nargs='*', help='run just these scenarios')
+    parser.add_argument('--server', nargs='?', const='wsgi', choices=['wsgi', 'asgi'],
+                        help='benchmark a multi-worker server over HTTP: gunicorn (wsgi, the default) or uvicorn (asgi)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight at once')
+    parser.add_argument('--pagination', default='offset', choices=['offset', 'keyset'])
+    parser.add_argument('--cache', default='null', help="CACHE_TYPE; 'null' times the views themselves")
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='a previous --output file to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='allowed p95 slowdown, 0.25 = 25%%')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        from werkzeug.serving import run_simple
+        run_simple('127.0.0.1', args.serve, make_app(), processes=args.workers, threaded=False)
+        return
+
+    directory = tempfile.mkdtemp()
+    os.environ.update(SECRET_KEY='bench', RATELIMIT_ENABLED='0', CACHE_TYPE=args.cache, USER_CACHE_TYPE=args.cache,
+                      FEED_PAGINATION=args.pagination, BCRYPT_LOG_ROUNDS=str(args.bcrypt_rounds),
+                      MAIL_QUEUE_WORKERS='0', SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(directory, 'bench.db'))
+    app = make_app()
+    started = time.perf_counter()
+    names = seed(app, args.users, args.posts)
+    print(f'seeded {args.users} users and {args.posts} posts in {time.perf_counter() - started:.1f}s')
+
+    server = None
+    if args.server:
+        port = free_port()
+        server = start_server(args.workers, port, args.server)
+        new_session = lambda: HTTPSession(f'http://127.0.0.1:{port}')
+    else:
+        new_session = lambda: ClientSession(app)
+    results = {
+        'meta': {'mode': args.server or 'test_client', 'workers': args.workers if args.server else None,
+                 'concurrency': args.concurrency, 'users': args.users, 'posts': args.posts,
+                 'pagination': args.pagination, 'cache': args.cache, 'bcrypt_rounds': args.bcrypt_rounds,
+                 'python': platform.python_version(), 'date': datetime.utcnow().isoformat(timespec='seconds')},
+        'scenarios': {},
+    }
+    try:
+        for name, (needs_writer, make_request) in scenarios(app, names, args.posts, app.config['POSTS_PER_PAGE']).items():
+            if args.only and name not in args.only:
+                continue
+            # queries can only be counted when the app runs in this process, one request at a time
+            result = run_scenario(name, make_request, new_session, needs_writer, args.requests, args.concurrency,
+                                  count_queries=not args.server and args.concurrency == 1, warmup=args.warmup)
+            results['scenarios'][name] = result
+            print(f"{name:<14} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                  f"p99 {result['p99_ms']:8.2f} ms  {result['throughput_rps']:8.1f} req/s  "
+                  f"queries {result['queries_per_request']}  errors {result['errors']}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(directory)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print('FAIL: ' + '; '.join(regressions))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
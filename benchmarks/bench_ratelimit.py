@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from bench_app import PASSWORD, make_app, percentile, seed
+
+# shows what a credential-stuffing attack on /login does to real users' logins, with and without rate limiting
+#     python benchmarks/bench_ratelimit.py --duration 20 --attack-rate 50
+# three phases: real users only, real users during an attack with rate limiting off, and the same attack with it on
+# attackers guess passwords for a separate set of existing accounts (so each guess costs a bcrypt check) from
+# --attack-ips addresses, at a steady --attack-rate like a botnet would; real users log in from addresses of their own
+
+def run_phase(app, duration, lead_in, legit_accounts, attacked_accounts, legit_threads, attack_threads, attack_ips,
+              attack_rate):
+    # attackers start lead_in seconds early, so we measure the steady state rather than the limits' initial allowance
+    measure_from = time.monotonic() + lead_in
+    deadline = measure_from + duration
+    legit, attack = [], []      # (seconds, status) per request
+    lock = threading.Lock()
+
+    def legit_user(n):
+        rng = random.Random(n)
+        time.sleep(max(0.0, measure_from - time.monotonic()))
+        while time.monotonic() < deadline:
+            client = app.test_client()  # a fresh visitor, so the login isn't short-circuited by an existing session
+            started = time.perf_counter()
+            status = client.post('/login', data={'email': f'{rng.choice(legit_accounts)}@example.com',
+                                                 'password': PASSWORD},
+                                 environ_base={'REMOTE_ADDR': f'10.0.{n}.{rng.randint(1, 254)}'}).status_code
+            with lock:
+                legit.append((time.perf_counter() - started, status))
+
+    def attacker(n):
+        rng = random.Random(1000 + n)
+        interval = attack_threads / attack_rate
+        next_at = time.monotonic()
+        while time.monotonic() < deadline:
+            # the attack sends at its own pace whether or not we keep up, unlike a user waiting for each page
+            next_at += interval
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_at = time.monotonic()
+            started = time.monotonic()
+            status = app.test_client().post(
+                '/login', data={'email': f'{rng.choice(attacked_accounts)}@example.com', 'password': 'hunter2'},
+                environ_base={'REMOTE_ADDR': f'203.0.113.{rng.randrange(attack_ips)}'}).status_code
+            if started >= measure_from:
+                with lock:
+                    attack.append((time.monotonic() - started, status))
+
+    threads = [threading.Thread(target=legit_user, args=(n,)) for n in range(legit_threads)]
+    threads += [threading.Thread(target=attacker, args=(n,)) for n in range(attack_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    timings = sorted(seconds * 1000 for seconds, status in legit)
+    return {
+        'legit_logins_per_s': round(sum(1 for _, status in legit if status == 302) / duration, 1),
+        'legit_success_rate': round(sum(1 for _, status in legit if status == 302) / max(1, len(legit)), 3),
+        'legit_p50_ms': round(statistics.median(timings), 1) if timings else None,
+        'legit_p95_ms': round(percentile(timings, 95), 1) if timings else None,
+        'attack_requests_per_s': round(len(attack) / duration, 1),
+        'attack_rejected_rate': round(sum(1 for _, status in attack if status == 429) / max(1, len(attack)), 3),
+        'attack_busy_rate': round(sum(1 for _, status in attack if status == 503) / max(1, len(attack)), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per phase')
+    parser.add_argument('--legit-threads', type=int, default=2)
+    parser.add_argument('--attack-threads', type=int, default=32, help='enough to keep up the rate while requests stall')
+    parser.add_argument('--lead-in', type=float, default=10.0, help='seconds the attack runs before measuring')
+    parser.add_argument('--attack-rate', type=float, default=50.0, help='attack requests per second, in total')
+    parser.add_argument('--attack-ips', type=int, default=4)
+    parser.add_argument('--bcrypt-rounds', type=int, default=10)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ.update(SECRET_KEY='bench', BCRYPT_LOG_ROUNDS=str(args.bcrypt_rounds), CACHE_TYPE='null',
+                      INSTRUMENTATION='0', SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(directory, 'bench.db'))
+    app = make_app()
+    names = seed(app, args.users, 0)
+    legit_accounts, attacked_accounts = names[:len(names) // 2], names[len(names) // 2:]
+
+    from flaskblog import limiter
+    from flaskblog.ratelimit import MemoryBackend
+    results = {}
+    for phase, enabled, attack_threads in (('baseline', True, 0), ('attack_unprotected', False, args.attack_threads),
+                                           ('attack_protected', True, args.attack_threads)):
+        limiter.enabled = enabled
+        limiter.backend = MemoryBackend()   # every phase starts with empty counters
+        results[phase] = run_phase(app, args.duration, args.lead_in if attack_threads else 0, legit_accounts, attacked_accounts,
+                                   args.legit_threads, attack_threads, args.attack_ips, args.attack_rate)
+        r = results[phase]
+        print(f"{phase:<19} legit {r['legit_logins_per_s']:6.1f} logins/s  p95 {r['legit_p95_ms']} ms  "
+              f"success {r['legit_success_rate']:.0%}  |  attack {r['attack_requests_per_s']:7.1f} req/s  "
+              f"429 {r['attack_rejected_rate']:.0%}  503 {r['attack_busy_rate']:.0%}")
+    shutil.rmtree(directory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import itertools
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# seeds a throwaway database with lots of posts, builds the search index and times /search queries
+#     python benchmarks/bench_search.py --posts 1000000
+# exits with status 1 if the 95th percentile query time is over --budget-ms
+
+WORDS = [f'word{n}' for n in range(20000)]
+
+def seed(db, Post, User, posts, batch_size=20000):
+    rng = random.Random(42)
+    # Zipf-like: a few very common words and a long tail of rare ones
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(WORDS))))
+    user = User(username='bench', email='bench@example.com', password='x')
+    db.session.add(user)
+    db.session.commit()
+    for start in range(0, posts, batch_size):
+        rows = [{'title': ' '.join(rng.choices(WORDS, cum_weights=weights, k=6)),
+                 'content': ' '.join(rng.choices(WORDS, cum_weights=weights, k=40)),
+                 'user_id': user.id}
+                for _ in range(min(batch_size, posts - start))]
+        db.session.execute(Post.__table__.insert(), rows)
+        db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--budget-ms', type=float, default=20.0)
+    parser.add_argument('--backend', default='auto')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ.update(SECRET_KEY='bench', SEARCH_BACKEND=args.backend, CACHE_TYPE='null',
+                      SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(directory, 'bench.db'))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from flaskblog import create_app, db
+    from flaskblog.models import Post, User
+    from flaskblog.search.index import rebuild, search
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(db, Post, User, args.posts)
+        print(f'seeded {args.posts} posts in {time.perf_counter() - started:.1f}s')
+        started = time.perf_counter()
+        rebuild(batch_size=5000)
+        print(f'built the search index in {time.perf_counter() - started:.1f}s')
+
+        rng = random.Random(7)
+        queries = []
+        for _ in range(args.queries):
+            # a mix of common words, rare words and two-word queries
+            queries.append(' '.join(rng.choice(WORDS[:50] if rng.random() < 0.3 else WORDS) for _ in range(rng.choice([1, 1, 2]))))
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            search(query, page=1, per_page=5)
+            timings.append((time.perf_counter() - started) * 1000)
+            db.session.remove()
+        timings.sort()
+        p50 = statistics.median(timings)
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        print(f'search over {args.posts} posts: p50 {p50:.2f} ms, p95 {p95:.2f} ms, p99 {p99:.2f} ms, max {timings[-1]:.2f} ms')
+        db.session.remove()
+        db.engine.dispose()
+    shutil.rmtree(directory)
+    if p95 > args.budget_ms:
+        print(f'FAIL: p95 is over the {args.budget_ms} ms budget')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from bench_app import ROOT, WRITER, make_app, seed
+
+# how long a fresh worker takes to become useful: importing flaskblog, create_app(), and its first requests
+# (each renders templates nobody has rendered in that process yet)
+#     python benchmarks/bench_startup.py --output before.json
+#     python benchmarks/bench_startup.py --compare before.json
+# every run is a new Python process; runs alternate between an empty template cache (what a worker without
+# `flask compile-templates` sees) and one filled by compile-templates beforehand
+# with --compare it exits with status 1 if either total got slower than --max-regression allows
+
+FIRST_REQUESTS = ('/home', '/post/1', f'/user/{WRITER}', '/login', '/register', '/about')
+
+def child(paths):
+    # runs in the fresh process; prints its timings as JSON
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import flaskblog    # noqa: F401
+    imported = time.perf_counter()
+    from flaskblog import create_app
+    app = create_app()
+    created = time.perf_counter()
+    client = app.test_client()
+    for path in paths:
+        status = client.get(path).status_code
+        if status != 200:
+            raise SystemExit(f'{path} returned {status}')
+    finished = time.perf_counter()
+    print(json.dumps({'import_ms': (imported - started) * 1000, 'create_app_ms': (created - imported) * 1000,
+                      'first_requests_ms': (finished - created) * 1000, 'total_ms': (finished - started) * 1000}))
+
+def run_child(env):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def summarize(runs):
+    return {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10, help='processes started per mode')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='a previous --output file to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='allowed slowdown, 0.2 = 20%%')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(FIRST_REQUESTS)
+        return
+
+    directory = tempfile.mkdtemp()
+    compiled = os.path.join(directory, 'compiled')
+    env = dict(os.environ, SECRET_KEY='bench', CACHE_TYPE='null', USER_CACHE_TYPE='null', INSTRUMENTATION='0',
+               SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(directory, 'bench.db'))
+    os.environ.update(env, TEMPLATE_CACHE_DIR=compiled)
+    app = make_app()
+    seed(app, 20, 200)
+    from flaskblog.templating import compile_templates
+    compile_templates(app)
+
+    modes = {'cold': [], 'precompiled': []}
+    try:
+        run_child(dict(env, TEMPLATE_CACHE='0'))    # untimed: lets Python write the .pyc files everyone else reads
+        for n in range(args.runs):
+            # cold gets a new, empty cache each time, so it never sees what an earlier run compiled
+            modes['cold'].append(run_child(dict(env, TEMPLATE_CACHE_DIR=os.path.join(directory, f'cold{n}'))))
+            modes['precompiled'].append(run_child(dict(env, TEMPLATE_CACHE_DIR=compiled)))
+    finally:
+        shutil.rmtree(directory)
+
+    results = {
+        'meta': {'runs': args.runs, 'first_requests': FIRST_REQUESTS, 'python': platform.python_version(),
+                 'date': datetime.utcnow().isoformat(timespec='seconds')},
+        'modes': {mode: summarize(runs) for mode, runs in modes.items()},
+    }
+    for mode, r in results['modes'].items():
+        print(f"{mode:<12} import {r['import_ms']:7.1f} ms  create_app {r['create_app_ms']:6.1f} ms  "
+              f"first requests {r['first_requests_ms']:6.1f} ms  total {r['total_ms']:7.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = []
+        for mode, after in results['modes'].items():
+            before = baseline['modes'].get(mode)
+            if before is None:
+                continue
+            change = after['total_ms'] / before['total_ms'] - 1
+            print(f"{mode:<12} total {before['total_ms']:7.1f} ms -> {after['total_ms']:7.1f} ms  {change:+.0%}")
+            if change > args.max_regression:
+                regressions.append(f'{mode}: total {change:+.0%}')
+        if regressions:
+            print('FAIL: ' + '; '.join(regressions))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
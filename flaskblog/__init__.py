@@ -4,9 +4,15 @@ from flask_bcrypt import Bcrypt
 from flask_login import LoginManager # flask_login manages the user login state and remember me functionality
 from flask_mail import Mail
 from flaskblog.config import Config
+from flaskblog.database import RoutingSession
+from flaskblog.cache import Cache
+from flaskblog.mailqueue import MailQueue
+from flaskblog.ratelimit import RateLimiter
+from flaskblog.users.hashing import PasswordHasher
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})    # reads from a replica in @read_only views, see database.py
 bcrypt = Bcrypt()
+hasher = PasswordHasher()   # runs bcrypt on its own bounded thread pool, see users/hashing.py
 login_manager = LoginManager()
 login_manager.login_view = 'users.login'
 # the view that we pass in here is the function name of our route
@@ -15,24 +21,49 @@ login_manager.login_view = 'users.login'
 login_manager.login_message_category = 'info'   # info class is a blue information alert from Bootstrap
 
 mail = Mail()
+mail_queue = MailQueue()    # sends mail from background workers, see mailqueue.py
+cache = Cache()     # rendered pages and post fragments, see cache.py
+limiter = RateLimiter()     # throttles logins, sign-ups and password resets, see ratelimit.py
 
 def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
     # from_object tells Flask to read and apply the configuration
+    from flaskblog import templating
+    templating.init_app(app)   # compiled templates from disk, see templating.py; must come before any template global
     db.init_app(app)
+    from flaskblog import database
+    database.init_app(app, db)     # SQLite pragmas and replica routing
     bcrypt.init_app(app)
+    hasher.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
+    mail_queue.init_app(app)
+    cache.init_app(app)
+    limiter.init_app(app)
+
+    from flaskblog import cli
+    cli.init_app(app)   # registers `flask upgrade-db` and the other maintenance commands
+    from flaskblog import querycount
+    querycount.init_app(app)
+    from flaskblog import instrumentation
+    instrumentation.init_app(app)   # Server-Timing headers, request logs and /metrics
+    from flaskblog.users import pictures, identity
+    pictures.init_app(app)  # picture_url()/picture_srcset() template helpers
+    identity.init_app(app)
 
     from flaskblog.users.routes import users
     from flaskblog.posts.routes import posts
     from flaskblog.main.routes import main
     from flaskblog.errors.handlers import errors
+    from flaskblog.search.routes import search
+    from flaskblog.api.routes import api
     app.register_blueprint(users)
     app.register_blueprint(posts)
     app.register_blueprint(main)
     app.register_blueprint(errors)
+    app.register_blueprint(search)
+    app.register_blueprint(api)
 
     return app
 
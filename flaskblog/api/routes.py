@@ -0,0 +1,160 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from itsdangerous import URLSafeSerializer, BadSignature
+from flask import Blueprint, Response, abort, current_app, request, stream_template, stream_with_context, url_for
+from werkzeug.http import http_date, is_resource_modified
+from flaskblog import db
+from flaskblog.database import read_only
+from flaskblog.models import Post, User
+
+# a read-only JSON API and Atom/RSS feeds, for syndicating and mirroring the blog
+#     GET /api/posts                          every post, oldest change first, API_PAGE_SIZE at a time (?limit= up to API_MAX_PAGE_SIZE)
+#     GET /api/posts?since=2024-05-01T12:00   only posts created or edited after that time (UTC)
+#     GET /api/posts?author=<username>
+#     GET /api/posts/<id>
+#     GET /feed.atom and /feed.rss            the newest FEED_LENGTH posts
+# list pages are keyset-paginated over (last_modified, id): follow "next" until it is null, then keep "cursor"
+# and pass it back later (?cursor=) to receive only what changed since; deleted posts simply stop appearing
+# rows are streamed from the database cursor straight into the response, so a page of 1000 posts is never held in memory
+
+api = Blueprint('api', __name__)
+
+YIELD_PER = 500     # rows fetched from the database cursor at a time
+
+COLUMNS = (Post.id, Post.title, Post.content, Post.date_posted, Post.last_modified, Post.word_count,
+           Post.reading_time, User.username.label('author'))
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='api-cursor')
+
+def _decode_cursor(cursor):
+    try:
+        last_modified, post_id = _serializer().loads(cursor)
+        return datetime.fromisoformat(last_modified), int(post_id)
+    except (BadSignature, ValueError, TypeError):
+        abort(400)
+
+def _after(last_modified, post_id):
+    # rows that come after (last_modified, post_id) in export order
+    return db.or_(Post.last_modified > last_modified, db.and_(Post.last_modified == last_modified, Post.id > post_id))
+
+def _parse_since(since):
+    try:
+        since = datetime.fromisoformat(since)
+    except ValueError:
+        abort(400)
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)     # the database stores naive UTC
+    return since
+
+def _timestamp(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _post_json(row):
+    return {'id': row.id, 'title': row.title, 'author': row.author, 'content': row.content,
+            'date_posted': _timestamp(row.date_posted), 'last_modified': _timestamp(row.last_modified),
+            'word_count': row.word_count, 'reading_time': row.reading_time,
+            'url': url_for('posts.post', post_id=row.id, _external=True)}
+
+def _etag(keys, *extra):
+    # the (id, last_modified) of every post on the page: editing, deleting or re-authoring one changes the tag
+    # extra is anything else that ends up in the body (cursor, next link); the host is in every post's url
+    return hashlib.sha256(repr((request.host_url, keys) + extra).encode()).hexdigest()[:32]
+
+def _not_modified(etag, last_modified=None):
+    return not is_resource_modified(request.environ, etag=etag, last_modified=last_modified)
+
+def _cacheable(response, etag, last_modified=None):
+    response.set_etag(etag)     # strong: the same tag always means byte-for-byte the same body
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+    response.cache_control.public = True
+    response.cache_control.max_age = 0
+    response.cache_control.s_maxage = current_app.config['SHARED_CACHE_MAX_AGE']
+    response.cache_control.must_revalidate = True
+    return response
+
+@api.route("/api/posts")
+@read_only
+def posts():
+    limit = max(1, min(request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int),
+                       current_app.config['API_MAX_PAGE_SIZE']))
+    criteria = []
+    if request.args.get('since'):
+        criteria.append(Post.last_modified > _parse_since(request.args['since']))
+    if request.args.get('author'):
+        criteria.append(User.username == request.args['author'])
+    cursor = request.args.get('cursor')
+    if cursor:
+        criteria.append(_after(*_decode_cursor(cursor)))
+    # a cheap first pass over the (last_modified, id) index gives us the page's ETag and the next cursor
+    # before we start streaming, since headers have to go out first
+    keys = db.session.execute(db.select(Post.last_modified, Post.id).join(User, Post.user_id == User.id)
+                              .where(*criteria).order_by(Post.last_modified, Post.id).limit(limit + 1)).all()
+    more = len(keys) > limit
+    keys = keys[:limit]
+    if keys:
+        cursor = _serializer().dumps([keys[-1].last_modified.isoformat(), keys[-1].id])
+    next_url = url_for('api.posts', _external=True, **dict(request.args.to_dict(), cursor=cursor)) if more else None
+    # the same posts can come with a different cursor or "next" link, e.g. once a post is added after the last page
+    etag = _etag([tuple(key) for key in keys], cursor, next_url)
+    if _not_modified(etag):
+        return _cacheable(Response(status=304), etag)
+
+    def generate():
+        yield '{"posts": ['
+        if keys:
+            # the same rows as the first pass (minus any deleted since), now with every column
+            last = keys[-1]
+            rows = db.session.execute(db.select(*COLUMNS).join(User, Post.user_id == User.id)
+                                      .where(*criteria, db.not_(_after(last.last_modified, last.id)))
+                                      .order_by(Post.last_modified, Post.id)
+                                      .execution_options(yield_per=YIELD_PER))
+            for n, row in enumerate(rows):
+                yield (',\n' if n else '\n') + json.dumps(_post_json(row))
+        yield f'\n], "cursor": {json.dumps(cursor)}, "next": {json.dumps(next_url)}}}\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    if next_url:
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return _cacheable(response, etag)
+
+@api.route("/api/posts/<int:post_id>")
+@read_only
+def post(post_id):
+    row = db.session.execute(db.select(*COLUMNS).join(User, Post.user_id == User.id).where(Post.id == post_id)).first()
+    if row is None:
+        abort(404)
+    etag = _etag([(row.last_modified, row.id)])
+    if _not_modified(etag, row.last_modified):
+        return _cacheable(Response(status=304), etag, row.last_modified)
+    return _cacheable(Response(json.dumps(_post_json(row)), mimetype='application/json'), etag, row.last_modified)
+
+def _feed(template, mimetype):
+    # the newest posts, like the home page
+    newest = (Post.date_posted.desc(), Post.id.desc())
+    keys = db.session.execute(db.select(Post.last_modified, Post.id).order_by(*newest)
+                              .limit(current_app.config['FEED_LENGTH'])).all()
+    etag = _etag([tuple(key) for key in keys])
+    updated = max((key.last_modified for key in keys), default=datetime(1970, 1, 1))
+    if _not_modified(etag, updated):
+        return _cacheable(Response(status=304), etag, updated)
+    def rows():
+        # queried once the stream starts: Flask tears down the view's session (handing its connection back to the
+        # pool) when the view returns, and gives the stream a fresh one
+        yield from db.session.execute(db.select(*COLUMNS).join(User, Post.user_id == User.id)
+                                      .where(Post.id.in_([key.id for key in keys])).order_by(*newest))
+    # stream_template renders as the rows come in instead of building the whole document first
+    body = stream_template(template, posts=rows(), updated=updated, timestamp=_timestamp, http_date=http_date)
+    return _cacheable(Response(body, mimetype=mimetype), etag, updated)
+
+@api.route("/feed.atom")
+@read_only
+def atom():
+    return _feed('feeds/atom.xml', 'application/atom+xml')
+
+@api.route("/feed.rss")
+@read_only
+def rss():
+    return _feed('feeds/rss.xml', 'application/rss+xml')
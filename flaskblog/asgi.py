@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+# serves the Flask app to ASGI servers (uvicorn, hypercorn, daphne), see asgi.py in the project directory
+# Flask itself stays a WSGI app: each request runs on a thread from a pool of ASGI_THREADS per worker process,
+# while the server's event loop handles the sockets, keep-alive and slow clients
+# asgiref's own WsgiToAsgi runs every request on one shared thread (sync_to_async's thread_sensitive default),
+# which would serve a single request at a time per process; this adapter gives them a real pool instead
+# keep views synchronous: Flask runs an `async def` view on the server's event loop here, so any blocking call in it
+# (every SQLAlchemy query is one) would stall all of that worker's connections; slow work already leaves the request
+# through the mail queue, the picture process pool and the bcrypt pool, and anything left only holds one pool thread
+
+BUFFER_SIZE = 16 * 1024     # streamed responses are sent in pieces of at least this many bytes
+
+class _Request(WsgiToAsgiInstance):
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._run, thread_sensitive=False, executor=self.executor)(body)
+
+    def _run(self, body):
+        # runs on a pool thread; each sync_send hands a message to the event loop and waits until it is sent
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:  # too many duplicate headers
+            self.sync_send({'type': 'http.response.start', 'status': 400, 'headers': [(b'content-type', b'text/plain')]})
+            self.sync_send({'type': 'http.response.body', 'body': b'Bad Request'})
+            return
+        response = self.wsgi_application(environ, self.start_response)
+        try:
+            # stream_template and the API yield lots of small strings; every send is a round trip to the
+            # event loop, so we gather them into bigger pieces first
+            pending, size = [], 0
+            for chunk in response:
+                pending.append(chunk)
+                size += len(chunk)
+                if size >= BUFFER_SIZE:
+                    self._send(b''.join(pending), more_body=True)
+                    pending, size = [], 0
+            self._send(b''.join(pending), more_body=False)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()    # WSGI servers must call this; it ends streamed responses' app context
+
+    def _send(self, body, more_body):
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        if body or not more_body:
+            self.sync_send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    def __init__(self, wsgi_application, threads):
+        super().__init__(wsgi_application)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi-request')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            # nothing to set up, since create_app() already ran; answering keeps servers from logging an error
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self.executor.shutdown(wait=False)  # servers send this once open requests have finished
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        await _Request(self.wsgi_application, self.executor)(scope, receive, send)
+
+def to_asgi(app):
+    return ThreadedWsgiToAsgi(app, app.config['ASGI_THREADS'])
@@ -0,0 +1,263 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from functools import wraps
+from flask import current_app, g, request, session, render_template, make_response
+from flask_login import current_user
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
+
+# a small caching layer for rendered pages and per-post HTML fragments
+# backends all implement the same get/set/delete/clear interface (BaseCache), so anything Redis-compatible can be plugged in
+
+_FOREVER = 10 * 365 * 24 * 3600     # timeout for version stamps in a shared cache, which should only go away when evicted
+
+class BaseCache:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, timeout=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def delete_many(self, *keys):
+        for key in keys:
+            self.delete(key)
+
+    def clear(self):
+        raise NotImplementedError
+
+class NullCache(BaseCache):
+    # used when CACHE_TYPE = 'null'; every lookup is a miss
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+class LRUCache(BaseCache):
+    # in-process cache: entries expire after their timeout, and once we hold `threshold` entries
+    # the least recently used one is evicted; each worker process has its own copy
+    def __init__(self, threshold=500, default_timeout=300):
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        self._entries = OrderedDict()   # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)  # mark as most recently used
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class RedisCache(BaseCache):
+    # shared cache for running several workers; works with Redis or any server speaking its protocol
+    def __init__(self, url, default_timeout=300, key_prefix='flaskblog:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_TYPE = 'redis' requires the redis package (pip install redis)")
+        self._client = redis.Redis.from_url(url)
+        self.default_timeout = default_timeout
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        value = self._client.get(self.key_prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        self._client.set(self.key_prefix + key, pickle.dumps(value), ex=timeout)
+
+    def delete(self, key):
+        self._client.delete(self.key_prefix + key)
+
+    def delete_many(self, *keys):
+        if keys:
+            self._client.delete(*[self.key_prefix + key for key in keys])
+
+    def clear(self):
+        for key in self._client.scan_iter(self.key_prefix + '*'):
+            self._client.delete(key)
+
+def make_backend(cache_type, threshold, default_timeout, redis_url=None):
+    if cache_type == 'lru':
+        return LRUCache(threshold, default_timeout)
+    if cache_type == 'redis':
+        return RedisCache(redis_url, default_timeout)
+    if cache_type == 'null':
+        return NullCache()
+    raise ValueError(f'Unknown cache type {cache_type!r}')
+
+class Cache:
+    # Flask extension in the same style as db/bcrypt/mail: created in flaskblog/__init__.py, bound in create_app
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.version_timeout = _FOREVER
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = make_backend(app.config['CACHE_TYPE'], app.config['CACHE_THRESHOLD'],
+                                    app.config['CACHE_DEFAULT_TIMEOUT'], app.config['CACHE_REDIS_URL'])
+        # an lru cache is per process, so a bump in one worker is never seen by the others; letting its version stamps
+        # expire like everything else bounds how long another worker can keep serving the old pages
+        self.version_timeout = app.config['CACHE_DEFAULT_TIMEOUT'] if app.config['CACHE_TYPE'] == 'lru' else _FOREVER
+        app.extensions['cache'] = self
+        app.add_template_global(post_fragment)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.backend.set(key, value, timeout)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def delete_many(self, *keys):
+        self.backend.delete_many(*keys)
+
+    def clear(self):
+        self.backend.clear()
+
+    # every cached page belongs to a scope ('home', 'post:<id>', 'user:<username>') with a version stamp;
+    # writes bump the version, so the old pages are never read again and simply age out of the cache
+    def version(self, scope):
+        version = self.get('version:' + scope)
+        if version is None:
+            version = time.time_ns()
+            self.set('version:' + scope, version, timeout=self.version_timeout)
+        return version
+
+    def bump(self, *scopes):
+        for scope in scopes:
+            self.set('version:' + scope, time.time_ns(), timeout=self.version_timeout)
+
+    def cached_page(self, scope):
+        # caches a view's rendered page for anonymous visitors; scope is formatted with the view arguments,
+        # e.g. @cache.cached_page('post:{post_id}')
+        def decorator(f):
+            @wraps(f)
+            def decorated_view(*args, **kwargs):
+                if not _is_cacheable_request():
+                    return current_app.ensure_sync(f)(*args, **kwargs)
+                page_scope = scope.format(**kwargs)
+                # conditional(), which runs first, leaves the page's database state in g: a page cached by a worker
+                # that missed another worker's bump still can't be served once the posts it shows have changed
+                key = f'page:{page_scope}:{self.version(page_scope)}:{g.get("page_state", "")}:{request.full_path}'
+                cached = self.get(key)
+                if cached is not None:
+                    body, status, mimetype = cached
+                    return current_app.response_class(body, status=status, mimetype=mimetype)
+                response = make_response(current_app.ensure_sync(f)(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    self.set(key, (response.get_data(), response.status_code, response.mimetype))
+                return response
+            return decorated_view
+        return decorator
+
+    def conditional(self, state):
+        # answers If-None-Match / If-Modified-Since with 304 Not Modified before the view (or any template) runs
+        # state(**view_args) is a cheap query for what the page shows, a tuple that starts with when it last changed,
+        # e.g. (updated, version) from feed_version for a feed, or None when there's no such page (the view 404s)
+        # it reads the database every worker shares, so a write made through any worker changes the validators
+        #     @cache.conditional(home_state)
+        #     @cache.conditional(post_state)
+        def decorator(f):
+            @wraps(f)
+            def decorated_view(*args, **kwargs):
+                if not _is_cacheable_request():
+                    # logged-in pages are personal: only the browser may keep them, and it has to ask us every time
+                    response = make_response(current_app.ensure_sync(f)(*args, **kwargs))
+                    response.cache_control.private = True
+                    response.cache_control.no_cache = True
+                    return response
+                current = state(**kwargs)
+                if current is None:
+                    return current_app.ensure_sync(f)(*args, **kwargs)    # no such row; let the view 404
+                modified = current[0].replace(tzinfo=timezone.utc)
+                etag = '-'.join([str(modified.timestamp())] + [str(part) for part in current[1:]])
+                modified = modified.replace(microsecond=0)
+                g.page_state = etag
+                if not is_resource_modified(request.environ, etag=etag, last_modified=modified):
+                    response = current_app.response_class(status=304)
+                else:
+                    response = make_response(current_app.ensure_sync(f)(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag)
+                response.last_modified = modified
+                response.cache_control.public = True
+                response.cache_control.max_age = 0     # browsers revalidate every time, which is cheap now
+                response.cache_control.s_maxage = current_app.config['SHARED_CACHE_MAX_AGE']
+                response.cache_control.must_revalidate = True
+                return response
+            return decorated_view
+        return decorator
+
+def _is_cacheable_request():
+    # logged-in users see their own navbar and post controls, and pending flash messages are one-off,
+    # so only plain anonymous GETs are served from the page cache
+    return (request.method in ('GET', 'HEAD')
+            and not current_user.is_authenticated
+            and '_flashes' not in session)
+
+def post_fragment(post):
+    # renders one feed entry (post_item.html), reusing the cached HTML when we have it;
+    # the fragment looks the same for every visitor, so logged-in users benefit too
+    # last_modified is part of the key (editing the post or renaming its author bumps it, see models.py), so a worker
+    # never renders a fragment another worker has made stale; the old ones simply age out
+    from flaskblog import cache
+    key = f'fragment:post:{post.id}:{post.last_modified.timestamp()}'
+    html = cache.get(key)
+    if html is None:
+        html = render_template('post_item.html', post=post)
+        cache.set(key, html)
+    return Markup(html)
+
+def invalidate_post(post, username=None):
+    # a post was created, edited or deleted: its page, the home feed and its author's feed are stale
+    from flaskblog import cache
+    cache.bump('home', f'post:{post.id}', f'user:{username or post.author.username}')
+
+def invalidate_author(user, old_username=None):
+    # the author's name or picture changed, which shows up on every page listing their posts
+    from flaskblog import cache
+    from flaskblog.models import Post
+    post_ids = [post_id for post_id, in Post.query.with_entities(Post.id).filter_by(user_id=user.id)]
+    scopes = ['home', f'user:{user.username}'] + [f'post:{post_id}' for post_id in post_ids]
+    if old_username and old_username != user.username:
+        scopes.append(f'user:{old_username}')
+    cache.bump(*scopes)
@@ -0,0 +1,35 @@
+import click
+from flask.cli import with_appcontext
+
+# maintenance commands, run with `flask --app run <command>` from the project directory
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db():
+    from flaskblog.migrations import upgrade
+    upgrade()
+    click.echo('Database is up to date.')
+
+@click.command('rebuild-search-index')
+@click.option('--batch-size', default=1000, help='Posts indexed per transaction.')
+@with_appcontext
+def rebuild_search_index(batch_size):
+    from flaskblog.search.index import rebuild
+    count = rebuild(batch_size)
+    click.echo(f'Indexed {count} posts.')
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates():
+    # run at deploy time, so that workers load compiled templates instead of compiling them on their first requests
+    from flask import current_app
+    from flaskblog.templating import cache_dir, compile_templates
+    if current_app.jinja_env.bytecode_cache is None:
+        raise click.ClickException('The template cache is turned off (TEMPLATE_CACHE), so there is nowhere to put them.')
+    count = compile_templates(current_app)
+    click.echo(f'Compiled {count} templates into {cache_dir(current_app)}.')
+
+def init_app(app):
+    app.cli.add_command(upgrade_db)
+    app.cli.add_command(rebuild_search_index)
+    app.cli.add_command(compile_templates)
@@ -6,8 +6,115 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI')
     # implements the relational query language SQL, useful for apps that have structured data
-    MAIL_SERVER = 'smtp.gmail.com'
-    MAIL_PORT = 587
-    MAIL_USE_TLS = True     # boolean flag to enable encrypted connections
+    # connection pool settings, passed on to create_engine() for the primary and the replica;
+    # pre_ping replaces connections the server has dropped, recycle retires them before a server-side timeout would
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_pre_ping': True,
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),   # seconds
+        **({'pool_size': int(os.environ['DB_POOL_SIZE'])} if os.environ.get('DB_POOL_SIZE') else {}),
+        **({'max_overflow': int(os.environ['DB_MAX_OVERFLOW'])} if os.environ.get('DB_MAX_OVERFLOW') else {}),
+    }
+    # with a replica configured, views marked @read_only (database.py) read from it; everything else uses the primary
+    # for local testing this can be a second SQLite file made from the primary; with WAL (below) recent commits live in
+    # site.db-wal rather than site.db, so copying site.db alone gives an old or corrupt replica. Use SQLite's backup:
+    #     sqlite3 site.db ".backup replica.db"
+    # or run `PRAGMA wal_checkpoint(TRUNCATE)` on the primary first and copy the file while nothing is writing
+    SQLALCHEMY_BINDS = {'replica': os.environ['SQLALCHEMY_REPLICA_URI']} if os.environ.get('SQLALCHEMY_REPLICA_URI') else {}
+    REPLICA_LAG_SECONDS = 5     # after a user commits, their reads go to the primary for this long
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')  # set on every SQLite connection
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    # bcrypt cost: each +1 doubles the time per hash; existing hashes are upgraded when their owners next log in
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    HASHING_WORKERS = int(os.environ.get('HASHING_WORKERS', os.cpu_count() or 2))     # hashes running at once
+    HASHING_QUEUE_SIZE = int(os.environ.get('HASHING_QUEUE_SIZE', 16))     # hashes allowed to wait before we answer 503
+    HASHING_TIMEOUT = 10        # seconds a request waits for its hash before giving up
+    HASHING_RETRY_AFTER = 2     # seconds, sent in the Retry-After header of the 503
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')    # point these at a local SMTP server (e.g. aiosmtpd) for testing
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', '1') == '1'     # boolean flag to enable encrypted connections
     MAIL_USERNAME = os.environ.get('EMAIL_USER')
-    MAIL_PASSWORD = os.environ.get('EMAIL_PASS')
\ No newline at end of file
+    MAIL_PASSWORD = os.environ.get('EMAIL_PASS')
+    # emails are queued and sent by background workers (mailqueue.py); 0 workers sends them inside the request
+    MAIL_QUEUE_WORKERS = int(os.environ.get('MAIL_QUEUE_WORKERS', 2))
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE', 1000))     # enqueueing past this fails fast
+    MAIL_BATCH_SIZE = 20            # messages a worker sends per wake-up over its open connection
+    MAIL_MAX_RETRIES = 5
+    MAIL_RETRY_BACKOFF = 5          # seconds before the first retry, doubling each time
+    MAIL_CONNECTION_IDLE = 30       # seconds before a worker closes its idle SMTP connection
+    MAIL_RECOVER_INTERVAL = 60      # seconds between checks for mail left behind by a worker process that died
+    MAIL_SPOOL_DIR = os.environ.get('MAIL_SPOOL_DIR')   # queued messages survive restarts here; defaults to instance/mail_spool
+
+    # requests one worker process serves at once under an ASGI server (flaskblog/asgi.py); each holds a database
+    # connection while it runs, so keep this within the pool's pool_size + max_overflow (5 + 10 by default)
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 15))
+
+    POSTS_PER_PAGE = 5
+    # 'offset' keeps the numbered page links; 'keyset' switches the feeds to Newer/Older cursor links,
+    # which stay fast no matter how deep you page
+    FEED_PAGINATION = os.environ.get('FEED_PAGINATION', 'offset')
+    FEED_COUNT_CACHE_TTL = int(os.environ.get('FEED_COUNT_CACHE_TTL', 60))  # seconds a feed's total post count is reused
+
+    # with CHECK_QUERY_BUDGET set, a feed page that issues more SQL statements than this fails (see querycount.py);
+    # each budget is the feed query + its cached count + the logged-in user, plus the author lookup on user pages
+    QUERY_BUDGET = {'main.home': 3, 'users.user_posts': 4, 'posts.post': 2} if os.environ.get('CHECK_QUERY_BUDGET') else None
+
+    # 'lru' keeps pages in each worker's memory; use 'redis' (with CACHE_REDIS_URL) so several workers share
+    # one cache and see each other's invalidations, or 'null' to turn caching off
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'lru')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 300))  # seconds
+    CACHE_THRESHOLD = int(os.environ.get('CACHE_THRESHOLD', 500))   # max entries in the lru cache
+    # anonymous feed and post pages carry ETag/Last-Modified and answer conditional requests with 304;
+    # a CDN or reverse proxy may reuse them for this many seconds without asking (s-maxage), browsers always ask
+    SHARED_CACHE_MAX_AGE = int(os.environ.get('SHARED_CACHE_MAX_AGE', 0))
+    PROFILE_PICTURE_MAX_AGE = 365 * 24 * 3600   # picture files are named after their content, so they never change
+
+    # profile pictures are resized by PICTURE_WORKERS background processes into these sizes (plus WebP copies)
+    PICTURE_WORKERS = int(os.environ.get('PICTURE_WORKERS', 2))
+    PICTURE_SIZES = (64, 125, 128, 250)     # 1x and 2x of the 64px feed and 125px account pictures
+    PICTURE_MAX_BYTES = 10 * 1024 * 1024
+    PICTURE_MAX_PIXELS = 40_000_000
+    PICTURE_UPLOAD_DIR = os.environ.get('PICTURE_UPLOAD_DIR')   # temp files for uploads; defaults to instance/uploads
+
+    # 'auto' uses SQLite's FTS5 on SQLite and our own inverted index (the search_term table) on other databases
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+    SEARCH_CANDIDATES = 1000    # only the newest this-many matches are ranked, which keeps common words fast
+
+    # snapshots of logged-in users, so current_user doesn't cost a query per request (users/identity.py)
+    USER_CACHE_TYPE = os.environ.get('USER_CACHE_TYPE', 'lru')     # 'redis' shares them between workers via CACHE_REDIS_URL
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 300    # seconds; also bounds how stale another worker's lru copy can get
+
+    # per-request timing (instrumentation.py): Server-Timing headers, JSON request logs on the 'flaskblog.requests'
+    # logger, and Prometheus metrics at /metrics (protected by a bearer token when METRICS_TOKEN is set)
+    INSTRUMENTATION = os.environ.get('INSTRUMENTATION', '1') == '1'
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))   # slower requests are logged as warnings
+    N_PLUS_ONE_THRESHOLD = 5    # the same statement this many times in one request gets logged as a likely N+1
+    # samples the stacks of request threads and saves a profile of every slow request (opt-in)
+    PROFILE_SLOW_REQUESTS = os.environ.get('PROFILE_SLOW_REQUESTS') == '1'
+    PROFILE_INTERVAL = 0.005    # seconds between samples
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')     # defaults to instance/profiles
+
+    # compiled templates are kept on disk and shared by all workers (templating.py); `flask compile-templates`
+    # fills the cache at deploy time so the first requests don't compile anything. Defaults to instance/template_cache
+    TEMPLATE_CACHE = os.environ.get('TEMPLATE_CACHE', '1') == '1'
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+
+    # the JSON API and Atom/RSS feeds (api/routes.py)
+    API_PAGE_SIZE = 100         # posts per /api/posts page unless ?limit= asks otherwise
+    API_MAX_PAGE_SIZE = 1000
+    FEED_LENGTH = 20            # posts in /feed.atom and /feed.rss
+
+    # throttling for the views attackers like (ratelimit.py): per endpoint, 'ip' limits each client address and
+    # any other key limits the value of that form field, e.g. attempts per account on login
+    # behind a reverse proxy, wrap the app in werkzeug's ProxyFix so the client address is the real one
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+    RATELIMIT_STORAGE = os.environ.get('RATELIMIT_STORAGE', 'memory')     # 'redis' shares the counters between workers
+    RATELIMIT_REDIS_URL = os.environ.get('RATELIMIT_REDIS_URL')    # defaults to CACHE_REDIS_URL
+    RATELIMITS = {
+        'users.login': {'ip': '30/minute; 300/hour', 'email': '10/minute; 50/hour'},
+        'users.register': {'ip': '10/hour'},
+        'users.reset_request': {'ip': '10/hour', 'email': '3/hour'},
+    }
@@ -0,0 +1,52 @@
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+# database plumbing that Flask-SQLAlchemy doesn't do for us:
+# SQLite pragmas on every new connection, and sending read-only views to a replica when one is configured
+
+class RoutingSession(Session):
+    # Flask-SQLAlchemy's session, except that inside a @read_only view it reads from the 'replica' bind;
+    # flushes (INSERT/UPDATE/DELETE) and commits always go to the primary
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _use_replica() and 'replica' in self._db.engines:
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def _use_replica():
+    if not g.get('read_only'):
+        return False
+    # right after a user writes something, the replica may not have it yet,
+    # so for a few seconds that user reads from the primary and sees their own change
+    return session.get('_primary_until', 0) < time.time()
+
+def read_only(f):
+    # marks a view that only reads, so its queries may be served by the replica
+    @wraps(f)
+    def decorated_view(*args, **kwargs):
+        g.read_only = True
+        return current_app.ensure_sync(f)(*args, **kwargs)
+    return decorated_view
+
+def _pin_to_primary(db_session):
+    if has_request_context() and current_app.config['SQLALCHEMY_BINDS'].get('replica'):
+        session['_primary_until'] = time.time() + current_app.config['REPLICA_LAG_SECONDS']
+
+def _set_sqlite_pragmas(app):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # in WAL mode readers no longer block the writer (or the other way round);
+        # synchronous=NORMAL is safe with WAL and skips an fsync on every commit
+        cursor.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+        cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+        cursor.close()
+    return on_connect
+
+def init_app(app, db):
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _set_sqlite_pragmas(app))
+    event.listen(db.session, 'after_commit', _pin_to_primary)
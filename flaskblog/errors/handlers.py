@@ -1,4 +1,6 @@
 from flask import Blueprint, render_template
+from flaskblog.users.hashing import HashingBusy
+from flaskblog.ratelimit import RateLimitExceeded
 
 errors = Blueprint('errors', __name__)
 
@@ -13,3 +15,13 @@ def error_403(error):
 @errors.app_errorhandler(500)
 def error_500(error):
     return render_template('errors/500.html'), 500
+
+@errors.app_errorhandler(HashingBusy)
+def error_hashing_busy(error):
+    # too many logins/sign-ups are waiting on bcrypt; tell the client to come back shortly instead of queueing it
+    retry_after = error.args[0]
+    return render_template('errors/503.html'), 503, {'Retry-After': str(retry_after)}
+
+@errors.app_errorhandler(RateLimitExceeded)
+def error_rate_limited(error):
+    return render_template('errors/429.html'), 429, {'Retry-After': str(error.retry_after)}
@@ -0,0 +1,215 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import (Response, abort, before_render_template, current_app, g, has_request_context,
+                   request, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# shows where the time goes inside each request:
+#   - SQL: how many statements and how long they took, plus a warning when one statement repeats (an N+1 pattern)
+#   - templates: time spent in render_template, nested renders (post_fragment) counted once
+#   - a Server-Timing header, so the numbers show up in the browser's network tab
+#   - one JSON log line per request on the 'flaskblog.requests' logger
+#   - /metrics in Prometheus' text format, with a latency histogram per endpoint
+#   - optionally, a sampling profiler that writes a collapsed-stack profile of every slow request
+# the statement count itself comes from querycount.py
+
+log = logging.getLogger('flaskblog.requests')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)     # seconds
+
+class Metrics:
+    # in-memory counters and histograms for /metrics; each worker process keeps its own,
+    # so scrape every worker (or run one worker per scrape target)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()       # (endpoint, method, status) -> count
+        self.latency = defaultdict(lambda: [0] * (len(BUCKETS) + 1))     # (endpoint, method) -> bucket counts
+        self.latency_sum = Counter()    # (endpoint, method) -> seconds
+        self.sql_statements = Counter()     # endpoint -> count
+        self.sql_seconds = Counter()
+        self.template_seconds = Counter()
+        self.n_plus_one = Counter()
+
+    def observe(self, endpoint, method, status, seconds, statements, sql_seconds, template_seconds, n_plus_one):
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            buckets = self.latency[endpoint, method]
+            for n, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[n] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            self.latency_sum[endpoint, method] += seconds
+            self.sql_statements[endpoint] += statements
+            self.sql_seconds[endpoint] += sql_seconds
+            self.template_seconds[endpoint] += template_seconds
+            self.n_plus_one[endpoint] += n_plus_one
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += ['# HELP flaskblog_requests_total Requests handled, by endpoint, method and status.',
+                      '# TYPE flaskblog_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'flaskblog_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            lines += ['# HELP flaskblog_request_duration_seconds Time from the start of the request to the response.',
+                      '# TYPE flaskblog_request_duration_seconds histogram']
+            for (endpoint, method), buckets in sorted(self.latency.items()):
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), buckets):     # Prometheus buckets are cumulative
+                    cumulative += count
+                    lines.append(f'flaskblog_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'flaskblog_request_duration_seconds_sum{{{labels}}} {self.latency_sum[endpoint, method]:.6f}')
+                lines.append(f'flaskblog_request_duration_seconds_count{{{labels}}} {cumulative}')
+            for name, help_text, values in (
+                    ('flaskblog_sql_statements_total', 'SQL statements sent to the database.', self.sql_statements),
+                    ('flaskblog_sql_seconds_total', 'Time spent waiting on SQL statements.', self.sql_seconds),
+                    ('flaskblog_template_seconds_total', 'Time spent rendering templates.', self.template_seconds),
+                    ('flaskblog_n_plus_one_total', 'Requests that repeated one SQL statement too often.', self.n_plus_one)):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                lines += [f'{name}{{endpoint="{endpoint}"}} {value:g}' for endpoint, value in sorted(values.items())]
+        from flaskblog import hasher
+        lines += ['# HELP flaskblog_password_hash_seconds_total Time spent in bcrypt, and waiting for a bcrypt thread.',
+                  '# TYPE flaskblog_password_hash_seconds_total counter']
+        hashing = sorted(hasher.metrics().items())
+        lines += [f'flaskblog_password_hash_seconds_total{{operation="{name}"}} {m["total"]:.6f}' for name, m in hashing]
+        lines += ['# HELP flaskblog_password_hash_total Hashes run, waited for, rejected or timed out.',
+                  '# TYPE flaskblog_password_hash_total counter']
+        lines += [f'flaskblog_password_hash_total{{operation="{name}"}} {m["count"]}' for name, m in hashing]
+        return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+    # one background thread that, every PROFILE_INTERVAL seconds, records the stack of each thread serving a request;
+    # cheap enough to leave on, since request threads are only looked at, never interrupted
+    def __init__(self, interval):
+        self.interval = interval
+        self._samples = {}      # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name='sampling-profiler', daemon=True).start()
+
+    def start(self):
+        with self._lock:
+            self._samples[threading.get_ident()] = Counter()
+
+    def stop(self):
+        with self._lock:
+            return self._samples.pop(threading.get_ident(), Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+def _collapse(frame):
+    # "file:function;file:function;..." outermost first, the format flamegraph.pl and speedscope read
+    stack = []
+    while frame is not None:
+        stack.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_statement(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['statement_started'].pop()
+    if has_request_context() and 'request_started' in g:
+        g.sql_seconds += elapsed
+        g.statements[statement] += 1    # parameters are bound separately, so N+1 queries share one statement text
+
+def _template_started(sender, template, context, **extra):
+    if has_request_context() and 'request_started' in g:
+        g.template_stack.append(time.perf_counter())
+
+def _template_finished(sender, template, context, **extra):
+    if has_request_context() and g.get('template_stack'):
+        started = g.template_stack.pop()
+        if not g.template_stack:    # only the outermost render counts, or fragments would be counted twice
+            g.template_seconds += time.perf_counter() - started
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.sql_seconds = 0.0
+    g.statements = Counter()
+    g.template_stack = []
+    g.template_seconds = 0.0
+    profiler = current_app.extensions.get('profiler')
+    if profiler is not None:
+        profiler.start()
+
+def _finish_request(response):
+    if 'request_started' not in g:
+        return response
+    config = current_app.config
+    seconds = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unknown'
+    statements = g.get('query_count', 0)
+    repeated = {statement: count for statement, count in g.statements.items()
+                if count >= config['N_PLUS_ONE_THRESHOLD']}
+    for statement, count in repeated.items():
+        log.warning('Possible N+1 in %s: ran %d times: %s', endpoint, count, ' '.join(statement.split())[:200])
+    current_app.extensions['metrics'].observe(endpoint, request.method, response.status_code, seconds, statements,
+                                              g.sql_seconds, g.template_seconds, 1 if repeated else 0)
+    if config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = (f'db;dur={g.sql_seconds * 1000:.1f};desc="{statements} queries", '
+                                             f'tpl;dur={g.template_seconds * 1000:.1f}, '
+                                             f'total;dur={seconds * 1000:.1f}')
+    log.info(json.dumps({'method': request.method, 'path': request.path, 'endpoint': endpoint,
+                         'status': response.status_code, 'duration_ms': round(seconds * 1000, 2),
+                         'sql_ms': round(g.sql_seconds * 1000, 2), 'queries': statements,
+                         'template_ms': round(g.template_seconds * 1000, 2)}))
+    if seconds * 1000 > config['SLOW_REQUEST_MS']:
+        log.warning('Slow request: %s %s took %.0f ms', request.method, request.path, seconds * 1000)
+        profiler = current_app.extensions.get('profiler')
+        if profiler is not None:
+            _save_profile(endpoint, profiler.stop())
+    return response
+
+def _stop_profiling(exception):
+    profiler = current_app.extensions.get('profiler')
+    if profiler is not None:
+        profiler.stop()     # a no-op if _finish_request already collected the samples
+
+def _save_profile(endpoint, samples):
+    if not samples:
+        return
+    directory = current_app.config['PROFILE_DIR'] or os.path.join(current_app.instance_path, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-{os.getpid()}.txt')
+    with open(path, 'w') as f:
+        f.writelines(f'{stack} {count}\n' for stack, count in samples.most_common())
+    log.warning('Saved a profile of the slow request to %s', path)
+
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    return Response(current_app.extensions['metrics'].render(), mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    if not app.config['INSTRUMENTATION']:
+        return
+    app.extensions['metrics'] = Metrics()
+    if app.config['PROFILE_SLOW_REQUESTS']:
+        app.extensions['profiler'] = SamplingProfiler(app.config['PROFILE_INTERVAL'])
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_stop_profiling)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,200 @@
+import fcntl
+import json
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from flask_mail import Message
+
+# background delivery for outgoing email: the request only writes the message to the spool and queues it,
+# and a small pool of worker threads does the slow SMTP work, each reusing one open connection
+
+log = logging.getLogger(__name__)
+
+class MailQueueFull(Exception):
+    pass
+
+class MailQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._started = False
+        self._owner = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['MAIL_QUEUE_WORKERS']
+        self.batch_size = app.config['MAIL_BATCH_SIZE']
+        self.max_retries = app.config['MAIL_MAX_RETRIES']
+        self.retry_backoff = app.config['MAIL_RETRY_BACKOFF']
+        self.idle_timeout = app.config['MAIL_CONNECTION_IDLE']
+        self.recover_interval = app.config['MAIL_RECOVER_INTERVAL']
+        self.spool_dir = app.config['MAIL_SPOOL_DIR'] or os.path.join(app.instance_path, 'mail_spool')
+        self._queue = queue.Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+        app.extensions['mail_queue'] = self
+        if self.workers:
+            # mail left behind by a crashed or restarted process goes out as soon as a worker serves its first
+            # request, rather than waiting for somebody to send a new email
+            app.before_request(self._start)
+
+    def enqueue(self, msg):
+        # called from the request; it only touches the local disk, never the SMTP server
+        if not self.workers:
+            from flaskblog import mail
+            mail.send(msg)      # MAIL_QUEUE_WORKERS = 0 keeps the old synchronous behaviour
+            return
+        self._start()
+        job_id = uuid.uuid4().hex
+        self._write_job(job_id, {'subject': msg.subject, 'sender': msg.sender, 'recipients': msg.recipients,
+                                 'body': msg.body, 'html': msg.html, 'attempts': 0})
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            os.remove(self._job_path(job_id))
+            raise MailQueueFull('The outgoing mail queue is full')
+
+    def _start(self):
+        # workers start on the first request or email rather than at import time, so CLI commands don't spawn threads
+        # (and so each process forked by the server gets its own threads and owner id)
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._owner = uuid.uuid4().hex
+            self._owner_lock = _create_locked(os.path.join(self.spool_dir, self._owner + '.lock'))
+            for n in range(self.workers):
+                threading.Thread(target=self._work, name=f'mail-worker-{n}', daemon=True).start()
+            threading.Thread(target=self._recover, name='mail-recover', daemon=True).start()
+            self._started = True
+
+    # the spool holds one JSON file per undelivered message, named <owner>-<job id>.json, where the owner is a
+    # random id each process picks when it starts; the process holds an exclusive lock on <owner>.lock for as long
+    # as it lives, and the OS drops that lock when it dies, so a message whose owner's lock is free is an orphan
+    # (a pid wouldn't do: a restarted container hands the same pids out again)
+    def _job_path(self, job_id):
+        return os.path.join(self.spool_dir, f'{self._owner}-{job_id}.json')
+
+    def _write_job(self, job_id, job):
+        path = self._job_path(job_id)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(path + '.tmp', path)     # atomic, so a crash never leaves half a message behind
+
+    def _read_job(self, job_id):
+        with open(self._job_path(job_id)) as f:
+            return json.load(f)
+
+    def _recover(self):
+        # at startup, then every MAIL_RECOVER_INTERVAL seconds, in case another worker dies while we run
+        while True:
+            try:
+                self._adopt_orphans()
+            except OSError as e:
+                log.error('Could not recover spooled emails: %s', e)
+            time.sleep(self.recover_interval)
+
+    def _adopt_orphans(self):
+        names = sorted(os.listdir(self.spool_dir))
+        gone = {}   # owner -> True once we know it has died
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            owner, job_id = name[:-len('.json')].split('-', 1)
+            if owner == self._owner:
+                continue
+            if owner not in gone:
+                gone[owner] = self._owner_gone(owner)
+            if not gone[owner]:
+                continue    # still being delivered by another worker process
+            try:
+                os.rename(os.path.join(self.spool_dir, name), self._job_path(job_id))
+            except FileNotFoundError:
+                continue    # another process adopted it first
+            self._queue.put(job_id)
+        # dead owners' lock files, once their messages are adopted
+        for name in names:
+            if not name.endswith('.lock'):
+                continue
+            owner = name[:-len('.lock')]
+            if owner != self._owner and (gone[owner] if owner in gone else self._owner_gone(owner)):
+                try:
+                    os.remove(os.path.join(self.spool_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def _owner_gone(self, owner):
+        try:
+            with open(os.path.join(self.spool_dir, owner + '.lock')) as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)   # released again when the file is closed
+        except FileNotFoundError:
+            return True     # cleaned up already, or written by an older version that named files by pid
+        except BlockingIOError:
+            return False
+        return True
+
+    def _work(self):
+        from flaskblog import mail
+        with self.app.app_context():    # Flask-Mail reads its settings from the app
+            connection = None
+            while True:
+                try:
+                    batch = [self._queue.get(timeout=self.idle_timeout)]
+                except queue.Empty:
+                    connection = _close(connection)     # SMTP servers drop idle clients, so we hang up first
+                    continue
+                while len(batch) < self.batch_size:     # send whatever else is waiting over the same connection
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for job_id in batch:
+                    try:
+                        job = self._read_job(job_id)
+                    except FileNotFoundError:
+                        continue
+                    try:
+                        if connection is None:
+                            connection = mail.connect().__enter__()
+                        connection.send(Message(job['subject'], sender=job['sender'], recipients=job['recipients'],
+                                                body=job['body'], html=job['html']))
+                    except (smtplib.SMTPException, OSError) as e:
+                        connection = _close(connection)
+                        self._retry(job_id, job, e)
+                    else:
+                        os.remove(self._job_path(job_id))
+
+    def _retry(self, job_id, job, error):
+        job['attempts'] += 1
+        if job['attempts'] > self.max_retries:
+            log.error('Giving up on email %s to %s: %s', job_id, job['recipients'], error)
+            os.replace(self._job_path(job_id), self._job_path(job_id) + '.failed')
+            return
+        self._write_job(job_id, job)
+        delay = self.retry_backoff * 2 ** (job['attempts'] - 1)     # exponential backoff: 5s, 10s, 20s, ...
+        log.warning('Email %s failed (%s), retrying in %ss', job_id, error, delay)
+        timer = threading.Timer(delay, self._queue.put, args=(job_id,))
+        timer.daemon = True
+        timer.start()
+
+def _close(connection):
+    if connection is not None:
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
+    return None
+
+def _create_locked(path):
+    # locks the file before it appears under its real name, so nobody can find it unlocked and take us for dead
+    f = open(path + '.tmp', 'w')
+    fcntl.flock(f, fcntl.LOCK_EX)
+    os.replace(path + '.tmp', path)
+    return f    # kept open (and locked) for the life of the process
@@ -1,15 +1,24 @@
-from flask import render_template, request, Blueprint
+from flask import render_template, Blueprint
+from flaskblog import cache
 from flaskblog.models import Post
+from flaskblog.pagination import paginate_feed, feed_state
+from flaskblog.database import read_only
 
 main = Blueprint('main', __name__)
 
+def home_state():
+    return feed_state('home')   # one primary-key lookup, far cheaper than rendering the feed
+
 @main.route("/")
 @main.route("/home")
+@read_only   # safe to serve from the replica database
+@cache.conditional(home_state)  # a browser or proxy that already has this page gets a bodiless 304
+@cache.cached_page('home')  # anonymous visitors get the rendered page straight from the cache
 def home():
-    page = request.args.get('page', 1, type=int)    # default page set to 1
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=5)
-    # date_posted.desc() gives us our posts from latest to oldest
-    # page=page is how we send a selected page to our query
+    posts = paginate_feed(Post.listing_query(), 'home')
+    # listing_query fetches each post's author in the same SELECT, instead of one extra query per post in home.html,
+    # and leaves out the full post content, since the feed only shows excerpts
+    # paginate_feed orders our posts from latest to oldest and reads ?page= (numbered links) or ?cursor= (keyset links)
     # this grabs the posts and displays them on the home screen
     return render_template('home.html', posts=posts)
     # we are passing these posts into our home template and gaining access
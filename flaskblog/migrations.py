@@ -0,0 +1,66 @@
+from flaskblog import db
+from flaskblog.models import Post, summarize
+
+# db.create_all() only creates missing tables, so anything we add to an existing table
+# (indexes, columns) gets an idempotent upgrade step here; run them with `flask upgrade-db`
+
+def add_post_last_modified():
+    columns = [column['name'] for column in db.inspect(db.engine).get_columns('post')]
+    if 'last_modified' in columns:
+        return
+    column_type = db.DateTime().compile(dialect=db.engine.dialect)
+    with db.engine.begin() as connection:
+        # existing rows need some value for the NOT NULL column; their own date_posted is the honest one
+        connection.execute(db.text(f"ALTER TABLE post ADD COLUMN last_modified {column_type} NOT NULL "
+                                   f"DEFAULT '1970-01-01 00:00:00'"))
+        connection.execute(db.text('UPDATE post SET last_modified = date_posted'))
+
+def add_post_summaries(batch_size=1000):
+    # the excerpt/word count/reading time columns, filled in for existing posts a batch at a time
+    table = Post.__table__
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns('post')}
+    with db.engine.begin() as connection:
+        for name in ('excerpt', 'word_count', 'reading_time'):
+            if name not in existing:
+                column_type = table.c[name].type.compile(dialect=db.engine.dialect)
+                connection.execute(db.text(f'ALTER TABLE post ADD COLUMN {name} {column_type}'))
+    # last_modified has onupdate=utcnow; filling in derived columns doesn't change what a post looks like,
+    # so keep its value (and every ETag and the API's export order that depend on it)
+    update = table.update().where(table.c.id == db.bindparam('post_id')).values(last_modified=table.c.last_modified)
+    last_id = 0
+    while True:
+        with db.engine.begin() as connection:   # one transaction per batch, so other writers get a turn in between
+            rows = connection.execute(db.select(table.c.id, table.c.content)
+                                      .where(table.c.excerpt.is_(None), table.c.id > last_id)
+                                      .order_by(table.c.id).limit(batch_size)).all()
+            if not rows:
+                break
+            values = []
+            for post_id, content in rows:
+                excerpt, word_count, reading_time = summarize(content)
+                values.append({'post_id': post_id, 'excerpt': excerpt, 'word_count': word_count,
+                               'reading_time': reading_time})
+            connection.execute(update, values)
+            last_id = rows[-1].id
+
+def create_feed_indexes():
+    for index in Post.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)   # checkfirst skips indexes that already exist
+
+def create_search_index():
+    # posts written before search existed are only findable once indexed
+    from flaskblog.search.index import get_backend, rebuild
+    if not get_backend().is_built():
+        rebuild()
+
+STEPS = [
+    add_post_last_modified,     # column changes first, since the later steps query Post
+    add_post_summaries,
+    create_feed_indexes,
+    create_search_index,
+]
+
+def upgrade():
+    db.create_all()
+    for step in STEPS:
+        step()
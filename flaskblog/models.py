@@ -1,14 +1,17 @@
+import math
 from datetime import datetime
 from itsdangerous import URLSafeTimedSerializer as Serializer
 from flask import current_app
 from flaskblog import db, login_manager # we can import from flaskblog instead of __main__ now, using the __init__.py file
 from flask_login import UserMixin
+from sqlalchemy.exc import IntegrityError
+from flaskblog.users import identity
 
 @login_manager.user_loader
 # this decorator registers the user loader function, which can be called to load a user given the ID (helps flask_login)
 def load_user(user_id):
-    return User.query.get(int(user_id))    # gets the user with that id and casts it to an integer
-    # all models have a query attribute that is the entry point to run database queries
+    return identity.load(int(user_id))    # gets the user with that id (cast to an integer), usually from the identity cache
+    # on a cache miss this runs User.query.get(); all models have a query attribute that is the entry point to run database queries
     # user_id naming convention required
 
 class User(db.Model, UserMixin):
@@ -34,9 +37,25 @@ class User(db.Model, UserMixin):
             return None
         return User.query.get(user_id)
 
+    def touch_posts(self):
+        # the author's name and picture appear on each of their post pages, so a change to either modifies those pages too
+        Post.query.filter_by(user_id=self.id).update({Post.last_modified: datetime.utcnow()}, synchronize_session=False)
+        FeedVersion.bump('home', f'user:{self.id}')     # and to the feeds that list them
+
     def __repr__(self):     # __repr__ is a special method used to represent a class’s objects as a string
         return f"User('{self.username}', '{self.email}', '{self.image_file}')"
 
+EXCERPT_LENGTH = 300    # characters
+WORDS_PER_MINUTE = 200
+
+def summarize(content):
+    # (excerpt, word count, reading time in minutes); a cut-short excerpt ends in an ellipsis
+    words = content.split()
+    excerpt = ' '.join(words)
+    if len(excerpt) > EXCERPT_LENGTH:
+        excerpt = excerpt[:EXCERPT_LENGTH].rsplit(' ', 1)[0] + '…'     # cut at the last whole word
+    return excerpt, len(words), max(1, math.ceil(len(words) / WORDS_PER_MINUTE))
+
 class Post(db.Model):
     id          = db.Column(db.Integer, primary_key=True)
     title       = db.Column(db.String(100), nullable=False)
@@ -45,10 +64,64 @@ class Post(db.Model):
     # if we run it with parentheses, the time you set it will permanently be the time displayed
     content     = db.Column(db.Text, nullable=False)
     user_id     = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # user.id is going to be the user who authored the post
+    last_modified = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # changes whenever the post's page would look different; browsers and proxies revalidate against it (cache.conditional)
+    # worked out from content whenever it is set (see summarize below), so feeds never have to load the full text
+    excerpt      = db.Column(db.String(EXCERPT_LENGTH + 1))
+    word_count   = db.Column(db.Integer)
+    reading_time = db.Column(db.Integer)    # minutes
+
+    __table_args__ = (
+        # composite indexes in feed order so keyset pagination (pagination.py) can seek straight to the next page
+        db.Index('ix_post_date_posted_id', 'date_posted', 'id'),
+        db.Index('ix_post_user_id_date_posted_id', 'user_id', 'date_posted', 'id'),
+        db.Index('ix_post_last_modified_id', 'last_modified', 'id'),     # export order of the API (api/routes.py)
+    )
+
+    @db.validates('content')
+    def summarize_content(self, key, content):
+        # runs every time post.content is assigned, i.e. in new_post and update_post
+        self.excerpt, self.word_count, self.reading_time = summarize(content)
+        return content
+
+    @classmethod
+    def listing_query(cls):
+        # what a feed shows: the excerpt instead of the content, and only the author's name and picture
+        return cls.query.options(db.defer(cls.content),
+                                 db.joinedload(cls.author).load_only(User.username, User.image_file))
 
     def __repr__(self):
         # this method tells Python how to print objects of the above class, which is useful for debugging
         return f"Post('{self.title}', '{self.date_posted}')"
 
+class SearchTerm(db.Model):
+    # inverted index used by search/index.py on databases without SQLite's FTS5: one row per word per post
+    __tablename__ = 'search_term'
+    term    = db.Column(db.String(64), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True, index=True)
+    weight  = db.Column(db.Float, nullable=False)   # how much of the post is about this word (title words count extra)
+
+class FeedVersion(db.Model):
+    # one row per feed ('home', 'user:<id>'), bumped in the same transaction as any write that changes what the feed
+    # shows; an indexed lookup of it is all cache.conditional needs, where max()/count() over post would scan the table
+    __tablename__ = 'feed_version'
+    key     = db.Column(db.String(40), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def bump(cls, *keys):
+        # call before db.session.commit(), so the new version is committed together with the change
+        now = datetime.utcnow()
+        for key in keys:
+            changes = {cls.version: cls.version + 1, cls.updated: now}
+            if cls.query.filter_by(key=key).update(changes, synchronize_session=False):
+                continue
+            try:
+                with db.session.begin_nested():     # a feed's first write creates its row
+                    db.session.add(cls(key=key, version=1, updated=now))
+            except IntegrityError:
+                cls.query.filter_by(key=key).update(changes, synchronize_session=False)   # another writer beat us to it
+
 # post model and user model will have a relationship since users will author posts;
 # this is a one-to-many relationship bc a users can have many posts but a post can only have one user
\ No newline at end of file
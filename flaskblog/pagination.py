@@ -0,0 +1,114 @@
+import time
+from datetime import datetime
+from itsdangerous import URLSafeSerializer, BadSignature
+from flask import current_app, request
+from flaskblog import db
+from flaskblog.models import FeedVersion, Post
+
+# keyset (a.k.a. cursor) pagination remembers the last row we showed instead of counting rows to skip,
+# so page 1000 costs the same as page 1; the (date_posted, id) pair is unique and matches the feed indexes in models.py
+
+_count_cache = {}   # cache key -> (expires_at, total); COUNT(*) is the slowest part of a feed request
+_seen_versions = {}     # cache key -> the feed_version this process last saw
+
+class KeysetPagination:
+    # mimics the attributes of Flask-SQLAlchemy's Pagination object that our templates use
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total      # None unless the caller asked for a (cached) count
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+def _serializer():
+    # signing the cursor keeps it opaque and stops clients from handing us arbitrary values
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='feed-cursor')
+
+def encode_cursor(post, direction):
+    return _serializer().dumps([post.date_posted.isoformat(), post.id, direction])
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        date_posted, post_id, direction = _serializer().loads(cursor)
+        return datetime.fromisoformat(date_posted), int(post_id), direction
+    except (BadSignature, ValueError, TypeError):
+        return None     # a bad cursor simply starts again from the newest post
+
+def keyset_paginate(query, cursor=None, per_page=5, total=None):
+    # query must be an unordered Post query (optionally filtered, e.g. by author)
+    key = decode_cursor(cursor)
+    if key is None or key[2] == 'next':
+        page_query = query.order_by(Post.date_posted.desc(), Post.id.desc())
+        if key:
+            date_posted, post_id, _ = key
+            page_query = page_query.filter(db.or_(Post.date_posted < date_posted,
+                db.and_(Post.date_posted == date_posted, Post.id < post_id)))
+        rows = page_query.limit(per_page + 1).all()    # one extra row tells us whether there is another page
+        items = rows[:per_page]
+        more_after = len(rows) > per_page
+        more_before = key is not None
+    else:
+        # walking backwards: read the newer rows in ascending order, then flip them for display
+        date_posted, post_id, _ = key
+        page_query = query.order_by(Post.date_posted.asc(), Post.id.asc())\
+            .filter(db.or_(Post.date_posted > date_posted,
+                db.and_(Post.date_posted == date_posted, Post.id > post_id)))
+        rows = page_query.limit(per_page + 1).all()
+        items = list(reversed(rows[:per_page]))
+        more_before = len(rows) > per_page
+        more_after = True
+    next_cursor = encode_cursor(items[-1], 'next') if items and more_after else None
+    prev_cursor = encode_cursor(items[0], 'prev') if items and more_before else None
+    return KeysetPagination(items, per_page, next_cursor, prev_cursor, total)
+
+def cached_count(query, key):
+    # exact counts are only needed for numbered page links and the "Posts by ..." heading,
+    # so we reuse a recent count for FEED_COUNT_CACHE_TTL seconds instead of running COUNT(*) every request
+    ttl = current_app.config['FEED_COUNT_CACHE_TTL']
+    now = time.monotonic()
+    cached = _count_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    total = query.order_by(None).count()
+    _count_cache[key] = (now + ttl, total)
+    return total
+
+def feed_state(count_key):
+    # (when the feed last changed, its version) for cache.conditional: one primary-key lookup in feed_version, which
+    # every write to the feed bumps (models.py); a feed nobody has written to since the table was added is version 0
+    row = db.session.query(FeedVersion.updated, FeedVersion.version).filter_by(key=count_key).first()
+    updated, version = row if row else (datetime(1970, 1, 1), 0)
+    if _seen_versions.get(count_key) != version:
+        # another worker changed the feed; recount, so the page we render matches the ETag it's sent with
+        invalidate_counts(count_key)
+        _seen_versions[count_key] = version
+    return updated, version
+
+def invalidate_counts(*keys):
+    # called after posts are created or deleted; no keys clears every cached count
+    if not keys:
+        _count_cache.clear()
+    for key in keys:
+        _count_cache.pop(key, None)
+
+def paginate_feed(query, count_key):
+    # picks the pagination mode for a feed view based on FEED_PAGINATION and the request arguments
+    per_page = current_app.config['POSTS_PER_PAGE']
+    cursor = request.args.get('cursor')
+    if cursor or current_app.config['FEED_PAGINATION'] == 'keyset':
+        return keyset_paginate(query, cursor, per_page, total=cached_count(query, count_key))
+    page = request.args.get('page', 1, type=int)
+    posts = query.order_by(Post.date_posted.desc(), Post.id.desc())\
+        .paginate(page=page, per_page=per_page, count=False)
+    posts.total = cached_count(query, count_key)   # iter_pages() still works off the cached total
+    return posts
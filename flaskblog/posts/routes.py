@@ -1,9 +1,13 @@
 from flask import (render_template, url_for, flash,
                     redirect, request, abort, Blueprint)
 from flask_login import current_user, login_required
-from flaskblog import db
-from flaskblog.models import Post
+from flaskblog import db, cache
+from flaskblog.cache import invalidate_post
+from flaskblog.search import index as search_index
+from flaskblog.models import FeedVersion, Post
 from flaskblog.posts.forms import PostForm
+from flaskblog.pagination import invalidate_counts
+from flaskblog.database import read_only
 
 posts = Blueprint('posts', __name__)
 
@@ -29,17 +33,30 @@ def new_post():
     form = PostForm()
     if form.validate_on_submit():
         # validate_on_submit does all the processing work; it will return TRUE when using POST method and confirming all field-attached validators
-        post = Post(title=form.title.data, content=form.content.data, author=current_user)
+        post = Post(title=form.title.data, content=form.content.data, user_id=current_user.id)
         db.session.add(post)
+        db.session.flush()  # gives the post its id so the search index can refer to it
+        search_index.index_post(post)
+        FeedVersion.bump('home', f'user:{post.user_id}')    # tells every worker's cache.conditional the feeds changed
         db.session.commit()
         # all changes to a database must be done in the context of a db.session
+        invalidate_counts('home', f'user:{post.user_id}')  # the feed totals just changed
+        invalidate_post(post, current_user.username)   # and so did the cached feed pages
         flash('Your post has been created!', 'success')
         return redirect(url_for('main.home'))
     return render_template('create_post.html', title='New Post', form=form, legend='New Post')
 
+def post_state(post_id):
+    # one indexed lookup, far cheaper than loading and rendering the post
+    last_modified = db.session.query(Post.last_modified).filter_by(id=post_id).scalar()
+    return None if last_modified is None else (last_modified,)
+
 @posts.route("/post/<int:post_id>")
+@read_only
+@cache.conditional(post_state)
+@cache.cached_page('post:{post_id}')
 def post(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = Post.query.options(db.joinedload(Post.author)).get_or_404(post_id)
     # this gives us the posts with the post_id or returns a 404 error page
     return render_template('post.html', title=post.title, post=post)
 
@@ -47,13 +64,16 @@ def post(post_id):
 @login_required
 def update_post(post_id):
     post = Post.query.get_or_404(post_id)
-    if post.author != current_user:
+    if post.user_id != current_user.id:
         abort(403)  # http response for a forbidden route
     form = PostForm()
     if form.validate_on_submit():
         post.title = form.title.data
         post.content = form.content.data
+        search_index.index_post(post)   # committed together with the post, so search never sees half an update
+        FeedVersion.bump('home', f'user:{post.user_id}')
         db.session.commit()
+        invalidate_post(post, current_user.username)
         flash('Your post has been updated!', 'success')
         return redirect(url_for('posts.post', post_id=post.id))
     elif request.method == 'GET':
@@ -65,9 +85,13 @@ def update_post(post_id):
 @login_required
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
-    if post.author != current_user:
+    if post.user_id != current_user.id:
         abort(403)
+    search_index.remove_post(post.id)
     db.session.delete(post)
+    FeedVersion.bump('home', f'user:{post.user_id}')
     db.session.commit()
+    invalidate_counts('home', f'user:{post.user_id}')
+    invalidate_post(post, current_user.username)
     flash('Your post has been deleted!', 'success')
     return redirect(url_for('main.home'))
\ No newline at end of file
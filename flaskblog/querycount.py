@@ -0,0 +1,52 @@
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# counts the SQL statements each request sends to the database;
+# with QUERY_BUDGET set (e.g. while testing) any request that goes over the budget fails loudly,
+# which is how we catch N+1 patterns like lazily loading post.author once per post in a feed
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class QueryCounter:
+    # context manager for counting statements outside of a request, e.g. in a shell or benchmark
+    #     with QueryCounter() as counter:
+    #         client.get('/')
+    #     assert counter.count <= 3
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self._record)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_request_query(conn, cursor, statement, parameters, context, executemany):
+    # listening on the Engine class covers every engine/bind Flask-SQLAlchemy creates
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+def _check_budget(response):
+    budget = _budget_for(request.endpoint)
+    count = g.get('query_count', 0)
+    if budget is not None and count > budget:
+        raise QueryBudgetExceeded(f'{request.endpoint} issued {count} queries (budget {budget})')
+    return response
+
+def _budget_for(endpoint):
+    budget = current_app.config.get('QUERY_BUDGET')
+    if isinstance(budget, dict):    # per-endpoint budgets, e.g. {'main.home': 3}
+        return budget.get(endpoint)
+    return budget
+
+def init_app(app):
+    app.after_request(_check_budget)
@@ -0,0 +1,155 @@
+import hashlib
+import math
+import re
+import threading
+import time
+from functools import wraps
+from flask import current_app, request
+
+# throttles the views an attacker can use to burn our CPU or mailbox: login (a bcrypt check per attempt),
+# register (a bcrypt hash) and reset_request (an email)
+# limits come from Config.RATELIMITS, per endpoint and per key ('ip' = the client address, anything else = that form
+# field, e.g. the email being logged into), and are checked before the form is validated or anything is hashed
+#     @users.route("/login", methods=['GET', 'POST'])
+#     @limiter.limit
+#     def login(): ...
+# counting uses sliding windows: the current fixed window's count plus the previous window's count, weighted by how
+# much of it still overlaps the last `period` seconds. Two counters per key, and no burst at window boundaries
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+LIMIT = re.compile(r'^\s*(\d+)\s*/\s*(second|minute|hour|day)\s*$')
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+def parse_limits(text):
+    # '10/minute; 100/hour' -> [(10, 60), (100, 3600)]
+    limits = []
+    for part in text.split(';'):
+        match = LIMIT.match(part)
+        if not match:
+            raise ValueError(f'Bad rate limit {part!r}, expected something like "10/minute"')
+        limits.append((int(match.group(1)), PERIODS[match.group(2)]))
+    return limits
+
+def _weighted(previous, current, period, now):
+    # the estimated number of hits in the last `period` seconds
+    elapsed = (now % period) / period
+    return previous * (1 - elapsed) + current
+
+def _retry_after(previous, current, limit, period, now):
+    # seconds until the estimate drops below the limit again
+    elapsed = (now % period) / period
+    if current >= limit or not previous:
+        return math.ceil((1 - elapsed) * period) or 1
+    needed = 1 - (limit - current) / previous  # how far into the window the previous one has to have faded
+    return max(1, math.ceil((needed - elapsed) * period))
+
+class MemoryBackend:
+    # per-process counters; with several workers each enforces the limit on its own share of the traffic
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._counts = {}   # key -> (window number, count in that window, count in the one before)
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, period):
+        # counts one hit and returns 0, or returns the seconds to wait if it is over the limit (and doesn't count it)
+        now = time.time()
+        window = int(now // period)
+        with self._lock:
+            start, current, previous = self._counts.get(key, (window, 0, 0))
+            if start != window:
+                previous = current if start == window - 1 else 0
+                current = 0
+            if _weighted(previous, current, period, now) >= limit:
+                self._counts[key] = (window, current, previous)
+                return _retry_after(previous, current, limit, period, now)
+            self._counts[key] = (window, current + 1, previous)
+            if len(self._counts) > self.max_keys:
+                self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        # an attack from many addresses shouldn't grow the table forever; keys idle for two windows count as zero anyway
+        for key, (start, current, previous) in list(self._counts.items()):
+            period = int(key.rsplit(':', 1)[1])
+            if start < int(now // period) - 1:
+                del self._counts[key]
+        # still full: forget the keys created longest ago, down to 90% so we don't end up pruning on every hit
+        for key in list(self._counts)[:len(self._counts) - int(self.max_keys * 0.9)]:
+            del self._counts[key]
+
+class RedisBackend:
+    # shared counters, so the limits hold across every worker and server
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATELIMIT_STORAGE = 'redis' requires the redis package (pip install redis)")
+        self._client = redis.Redis.from_url(url)
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        window = int(now // period)
+        current_key, previous_key = f'{key}:{window}', f'{key}:{window - 1}'
+        pipe = self._client.pipeline()
+        pipe.incr(current_key)
+        pipe.expire(current_key, period * 2)
+        pipe.get(previous_key)
+        current, _, previous = pipe.execute()
+        previous = int(previous or 0)
+        # we counted first so that concurrent workers can't both slip under the limit; undo it if it's over
+        if _weighted(previous, current - 1, period, now) >= limit:
+            self._client.decr(current_key)
+            return _retry_after(previous, current - 1, limit, period, now)
+        return 0
+
+def make_backend(storage, redis_url=None):
+    if storage == 'memory':
+        return MemoryBackend()
+    if storage == 'redis':
+        return RedisBackend(redis_url)
+    raise ValueError(f'Unknown rate limit storage {storage!r}')
+
+class RateLimiter:
+    # Flask extension in the same style as db/cache: created in flaskblog/__init__.py, bound in create_app
+    def __init__(self, app=None):
+        self.enabled = False
+        self.backend = None
+        self.limits = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['RATELIMIT_ENABLED']
+        self.backend = make_backend(app.config['RATELIMIT_STORAGE'],
+                                    app.config['RATELIMIT_REDIS_URL'] or app.config['CACHE_REDIS_URL'])
+        # parsed once here, so a typo in Config fails at startup rather than on the first login
+        # 'ip' goes first, since checking it needs nothing from the request body
+        self.limits = {endpoint: {key: parse_limits(keys[key]) for key in sorted(keys, key=lambda key: key != 'ip')}
+                       for endpoint, keys in app.config['RATELIMITS'].items()}
+        app.extensions['ratelimit'] = self
+
+    def limit(self, f):
+        # only POSTs count: showing the form costs us nothing
+        @wraps(f)
+        def decorated_view(*args, **kwargs):
+            if self.enabled and request.method == 'POST':
+                self.check(request.endpoint)
+            return current_app.ensure_sync(f)(*args, **kwargs)
+        return decorated_view
+
+    def check(self, endpoint):
+        # raises RateLimitExceeded (-> 429, see errors/handlers.py) once any of the endpoint's limits is used up
+        for name, limits in self.limits.get(endpoint, {}).items():
+            value = request.remote_addr if name == 'ip' else request.form.get(name, '').strip().lower()
+            if not value:
+                continue
+            # hashed, so email addresses don't end up in Redis in the clear
+            digest = hashlib.sha256(value.encode()).hexdigest()[:24]
+            for limit, period in limits:
+                retry_after = self.backend.hit(f'ratelimit:{endpoint}:{name}:{digest}:{period}', limit, period)
+                if retry_after:
+                    raise RateLimitExceeded(retry_after)
@@ -0,0 +1,194 @@
+import math
+import re
+from collections import Counter
+from flask import current_app
+from flaskblog import db
+from flaskblog.models import Post, SearchTerm
+
+# full-text search over post titles and content
+# on SQLite we use the built-in FTS5 extension; on other databases we keep our own inverted index in the search_term table
+# either way the index is updated in the same transaction as the post itself (see posts/routes.py, and the
+# triggers below for FTS5); `flask upgrade-db` creates and fills the index
+
+TOKEN = re.compile(r'\w+')
+TITLE_WEIGHT = 3.0      # in the inverted index, a word in the title counts as much as three in the body
+MAX_TERMS = 8           # longer queries are cut down; they rarely match anything anyway
+
+def tokenize(text):
+    return [token.lower()[:64] for token in TOKEN.findall(text or '')]
+
+class SearchResults:
+    # one page of results; we fetch one row past the page instead of counting every match
+    def __init__(self, items, page, per_page, has_next):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+class FTS5Backend:
+    # post_fts is an external-content FTS5 table: it holds only the index and reads titles and content from post
+    # itself, so the text isn't stored twice; triggers on post keep it in step, in the same transaction as whatever
+    # wrote the post (a view, a migration, a shell), so the views have nothing left to do for it
+    TRIGGERS = {
+        'post_fts_insert': 'AFTER INSERT ON post BEGIN '
+                           'INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END',
+        # external content can only be removed from the index with the exact values it was indexed with
+        'post_fts_delete': "AFTER DELETE ON post BEGIN INSERT INTO post_fts(post_fts, rowid, title, content) "
+                           "VALUES ('delete', old.id, old.title, old.content); END",
+        'post_fts_update': "AFTER UPDATE OF title, content ON post BEGIN INSERT INTO post_fts(post_fts, rowid, title, "
+                           "content) VALUES ('delete', old.id, old.title, old.content); INSERT INTO post_fts(rowid, "
+                           "title, content) VALUES (new.id, new.title, new.content); END",
+    }
+
+    def __init__(self):
+        self._built = False
+
+    def create(self):
+        # (re)creates the table and its triggers, empty; only `flask upgrade-db` and `flask rebuild-search-index`
+        # get here, never a request. Runs in the session's own transaction: a second connection would deadlock
+        # against it on SQLite. This also replaces the older post_fts that kept its own copy of every post
+        for name in self.TRIGGERS:
+            db.session.execute(db.text(f'DROP TRIGGER IF EXISTS {name}'))
+        db.session.execute(db.text('DROP TABLE IF EXISTS post_fts'))
+        db.session.execute(db.text(
+            "CREATE VIRTUAL TABLE post_fts USING fts5(title, content, content='post', content_rowid='id', "
+            "tokenize='unicode61')"))
+        for name, body in self.TRIGGERS.items():
+            db.session.execute(db.text(f'CREATE TRIGGER {name} {body}'))
+
+    def is_built(self):
+        # the table and every trigger; without them new posts would silently go unindexed
+        if not self._built:
+            names = db.session.execute(db.text(
+                "SELECT count(*) FROM sqlite_master WHERE name IN ('post_fts', {})"
+                .format(', '.join(f"'{name}'" for name in self.TRIGGERS)))).scalar()
+            self._built = names == 1 + len(self.TRIGGERS)
+        return self._built
+
+    def index_post(self, post):
+        pass    # the triggers on post take care of it
+
+    def remove_post(self, post_id):
+        pass
+
+    def clear(self):
+        self.create()
+
+    def search_ids(self, terms, limit, offset):
+        if not self.is_built():
+            return []   # nothing has been indexed yet
+        # quoting every term stops FTS5 from reading user input as query syntax (AND, NEAR, column filters...)
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        # we rank title matches above matches in the body only, newest first within each group;
+        # FTS5 walks matches newest first and stops after SEARCH_CANDIDATES, so even a word in every post is cheap
+        # (bm25() is not: it counts every post containing each word before scoring anything)
+        rows = db.session.execute(db.text(
+            'SELECT rowid FROM ('
+            '  SELECT * FROM (SELECT rowid, 0 AS tier FROM post_fts WHERE post_fts MATCH :title_match'
+            '                 ORDER BY rowid DESC LIMIT :candidates)'
+            '  UNION ALL'
+            '  SELECT * FROM (SELECT rowid, 1 AS tier FROM post_fts WHERE post_fts MATCH :match'
+            '                 ORDER BY rowid DESC LIMIT :candidates)'
+            ') GROUP BY rowid ORDER BY MIN(tier), rowid DESC LIMIT :limit OFFSET :offset'),
+            {'title_match': f'title : ({match})', 'match': match,
+             'candidates': current_app.config['SEARCH_CANDIDATES'], 'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+class InvertedIndexBackend:
+    # search_term holds one row per (term, post) with the term's weight in that post; db.create_all() makes the table
+    def is_built(self):
+        return SearchTerm.query.first() is not None
+    def index_post(self, post):
+        self.remove_post(post.id)
+        self.add_posts([post])
+
+    def add_posts(self, posts):
+        rows = []
+        for post in posts:
+            weights = Counter(tokenize(post.content))
+            for term in tokenize(post.title):
+                weights[term] += TITLE_WEIGHT
+            length = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            rows.extend({'term': term, 'post_id': post.id, 'weight': weight / length} for term, weight in weights.items())
+        if rows:
+            db.session.execute(SearchTerm.__table__.insert(), rows)     # one executemany instead of an object per word
+
+    def remove_post(self, post_id):
+        SearchTerm.query.filter_by(post_id=post_id).delete()
+
+    def clear(self):
+        SearchTerm.query.delete()
+
+    def search_ids(self, terms, limit, offset):
+        # score = sum of term weight * idf over the query terms, and every term has to match
+        total_posts = db.session.query(db.func.count(Post.id)).scalar() or 1
+        document_counts = dict(db.session.query(SearchTerm.term, db.func.count())
+                               .filter(SearchTerm.term.in_(terms)).group_by(SearchTerm.term))
+        if len(document_counts) < len(terms):
+            return []   # some term appears nowhere
+        idf = db.case({term: math.log(1 + total_posts / count) for term, count in document_counts.items()},
+                      value=SearchTerm.term)
+        score = db.func.sum(SearchTerm.weight * idf)
+        # like FTS5 above, only the newest SEARCH_CANDIDATES posts containing the rarest term get ranked
+        rarest = min(document_counts, key=document_counts.get)
+        candidates = db.session.query(SearchTerm.post_id).filter(SearchTerm.term == rarest)\
+            .order_by(SearchTerm.post_id.desc()).limit(current_app.config['SEARCH_CANDIDATES'])
+        rows = db.session.query(SearchTerm.post_id)\
+            .filter(SearchTerm.term.in_(terms), SearchTerm.post_id.in_(candidates.scalar_subquery()))\
+            .group_by(SearchTerm.post_id)\
+            .having(db.func.count() == len(terms))\
+            .order_by(score.desc(), SearchTerm.post_id.desc())\
+            .limit(limit).offset(offset)
+        return [post_id for post_id, in rows]
+
+def get_backend():
+    backend = current_app.extensions.get('search')
+    if backend is None:
+        name = current_app.config['SEARCH_BACKEND']
+        if name == 'auto':
+            name = 'fts5' if db.engine.dialect.name == 'sqlite' else 'inverted'
+        backend = FTS5Backend() if name == 'fts5' else InvertedIndexBackend()
+        current_app.extensions['search'] = backend
+    return backend
+
+def index_post(post):
+    # call after the post has an id (db.session.flush()) and before db.session.commit()
+    get_backend().index_post(post)
+
+def remove_post(post_id):
+    get_backend().remove_post(post_id)
+
+def search(query, page=1, per_page=5):
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]   # drops duplicates but keeps the order
+    if not terms:
+        return SearchResults([], page, per_page, False)
+    ids = get_backend().search_ids(terms, per_page + 1, (page - 1) * per_page)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    posts = {post.id: post for post in Post.listing_query().filter(Post.id.in_(ids))}
+    return SearchResults([posts[post_id] for post_id in ids if post_id in posts], page, per_page, has_next)
+
+def rebuild(batch_size=1000):
+    # re-indexes every post from scratch
+    backend = get_backend()
+    backend.clear()
+    if isinstance(backend, FTS5Backend):
+        # FTS5 reads every post straight from the post table, without loading them into Python
+        db.session.execute(db.text("INSERT INTO post_fts(post_fts) VALUES ('rebuild')"))
+        db.session.commit()
+        return db.session.query(db.func.count(Post.id)).scalar()
+    last_id, indexed = 0, 0
+    while True:     # a batch at a time, so we never hold every post in memory
+        batch = Post.query.filter(Post.id > last_id).order_by(Post.id).limit(batch_size).all()
+        if not batch:
+            break
+        backend.add_posts(batch)
+        last_id = batch[-1].id
+        indexed += len(batch)
+        db.session.commit()
+        db.session.expunge_all()    # keep the session from growing with every batch
+    return indexed
@@ -0,0 +1,12 @@
+from flask import render_template, request, Blueprint, current_app
+from flaskblog.search.index import search as search_posts
+
+search = Blueprint('search', __name__)
+
+@search.route("/search")
+def search_results():
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    results = search_posts(query, page=max(page, 1), per_page=current_app.config['POSTS_PER_PAGE'])
+    # results are ranked best match first; search.html shows them with the same post fragments as the feeds
+    return render_template('search.html', title='Search', query=query, results=results)
@@ -0,0 +1,43 @@
+import logging
+import os
+from jinja2 import FileSystemBytecodeCache
+
+# Jinja compiles each template to Python code the first time a worker renders it, so the first requests after a
+# deploy, a restart or a scale-up pay for compiling layout.html and every page template again
+# with the bytecode cache, compiled templates are kept on disk and shared by every worker and every restart;
+# `flask compile-templates` fills it at build/deploy time, so that even the very first request finds them compiled
+#     flask --app run compile-templates
+# entries are checked against the template source, so an edited template is recompiled rather than served stale;
+# the template's file path is part of the key, so run the command where (at the path) the app actually runs
+
+log = logging.getLogger(__name__)
+
+class BytecodeCache(FileSystemBytecodeCache):
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError as e:
+            # e.g. a read-only deploy: the template still renders, it just isn't saved for the next worker
+            log.warning('Could not save the compiled template %s: %s', bucket.key, e)
+
+def cache_dir(app):
+    return app.config['TEMPLATE_CACHE_DIR'] or os.path.join(app.instance_path, 'template_cache')
+
+def init_app(app):
+    # has to run before anything uses app.jinja_env (add_template_global does), since that creates the environment
+    if not app.config['TEMPLATE_CACHE']:
+        return
+    directory = cache_dir(app)
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        log.warning('Template cache disabled, could not create %s: %s', directory, e)
+        return
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': BytecodeCache(directory)}
+
+def compile_templates(app):
+    # loading a template compiles it and stores it in the bytecode cache; returns how many there were
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
@@ -0,0 +1,75 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# bcrypt is deliberately slow (~250 ms per hash at the default cost), so we run it on a small dedicated thread pool:
+# at most HASHING_WORKERS hashes run at once, at most HASHING_QUEUE_SIZE more may wait,
+# and anything beyond that is turned away immediately (HashingBusy -> 503) instead of tying up every request worker
+# bcrypt releases the GIL while hashing, so the pool threads really do run in parallel
+
+class HashingBusy(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self._executor = None
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.timeout = app.config['HASHING_TIMEOUT']
+        self.retry_after = app.config['HASHING_RETRY_AFTER']
+        self._executor = ThreadPoolExecutor(max_workers=app.config['HASHING_WORKERS'], thread_name_prefix='bcrypt')
+        # one slot per running or waiting job; when they are all taken we reject rather than queue forever
+        self._slots = threading.BoundedSemaphore(app.config['HASHING_WORKERS'] + app.config['HASHING_QUEUE_SIZE'])
+        app.extensions['password_hasher'] = self
+
+    def hash(self, password):
+        from flaskblog import bcrypt
+        return self._run('hash', bcrypt.generate_password_hash, password, self.rounds).decode('utf-8')
+
+    def check(self, hashed_password, password):
+        from flaskblog import bcrypt
+        return self._run('check', bcrypt.check_password_hash, hashed_password, password)
+
+    def needs_rehash(self, hashed_password):
+        # bcrypt hashes look like $2b$12$<salt+hash>, where 12 is the cost they were made with
+        try:
+            return int(hashed_password.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _run(self, operation, function, *args):
+        if not self._slots.acquire(blocking=False):
+            self._record(operation + '_rejected', 0)
+            raise HashingBusy(self.retry_after)
+        queued_at = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                finished = time.perf_counter()
+                self._record(operation + '_wait', started - queued_at)
+                self._record(operation, finished - started)
+                self._slots.release()
+        try:
+            return self._executor.submit(timed).result(timeout=self.timeout)
+        except TimeoutError:
+            self._record(operation + '_timeout', self.timeout)
+            raise HashingBusy(self.retry_after)
+
+    def _record(self, name, seconds):
+        with self._metrics_lock:
+            count, total, longest = self._metrics.get(name, (0, 0.0, 0.0))
+            self._metrics[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    def metrics(self):
+        # {'check': {'count': 12, 'total': 3.1, 'max': 0.29}, 'check_wait': {...}, 'hash_rejected': {...}, ...}
+        with self._metrics_lock:
+            return {name: {'count': count, 'total': total, 'max': longest}
+                    for name, (count, total, longest) in self._metrics.items()}
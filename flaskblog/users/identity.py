@@ -0,0 +1,60 @@
+from flask import current_app
+from flaskblog.cache import make_backend
+
+# Flask-Login calls our user_loader on every request from a logged-in user (layout.html checks current_user on every page),
+# so instead of a SELECT each time we keep a small read-only snapshot of each user in a cache
+# views that change a user load the real User row, and call forget() after committing
+
+class UserSnapshot:
+    # the handful of fields templates and views read from current_user; no password hash, no session, no lazy loading
+    __slots__ = ('id', 'username', 'email', 'image_file')
+
+    # what flask_login's UserMixin would give us (UserMixin itself has no __slots__)
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, username, email, image_file):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.image_file = image_file
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email, user.image_file)
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        # lets templates keep writing `post.author == current_user` with post.author being a real User
+        if hasattr(other, 'get_id'):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"UserSnapshot('{self.username}', '{self.email}', '{self.image_file}')"
+
+def init_app(app):
+    app.extensions['identity_cache'] = make_backend(app.config['USER_CACHE_TYPE'], app.config['USER_CACHE_SIZE'],
+                                                    app.config['USER_CACHE_TTL'], app.config['CACHE_REDIS_URL'])
+
+def load(user_id):
+    from flaskblog.models import User
+    cache = current_app.extensions['identity_cache']
+    key = f'identity:{user_id}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        cache.set(key, snapshot)
+    return snapshot
+
+def forget(user_id):
+    current_app.extensions['identity_cache'].delete(f'identity:{user_id}')
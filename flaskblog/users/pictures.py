@@ -0,0 +1,197 @@
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+from flask import current_app, request, url_for
+
+# profile picture pipeline: the request streams the upload to a temp file and checks its header,
+# then a process pool does the decoding and resizing so no request worker burns CPU on it
+# pictures are named after a hash of their content, so the same upload is only ever processed and stored once
+# PIL and the process pool are imported when a picture is first uploaded, not when the app starts:
+# PIL alone is a good share of create_app()'s import time, and most workers never see an upload
+
+log = logging.getLogger(__name__)
+
+FORMATS = {'JPEG': '.jpg', 'MPO': '.jpg', 'PNG': '.png'}   # image formats we accept, and the extension we store them under
+# MPO is what Pillow calls the multi-frame JPEGs many phone cameras write; we keep the first frame, like any JPEG viewer
+CHUNK_SIZE = 64 * 1024
+
+_pool = None
+_known_variants = set()
+
+class InvalidPicture(ValueError):
+    pass
+
+class StagedPicture:
+    # an upload that has been saved to a temp file and validated, but not resized yet
+    def __init__(self, path, digest, ext):
+        self.path = path
+        self.digest = digest
+        self.ext = ext
+
+    @property
+    def filename(self):
+        # 16 hex characters + extension fits the 20 character User.image_file column
+        return self.digest[:16] + self.ext
+
+def stage_picture(form_picture):
+    config = current_app.config
+    upload_dir = config['PICTURE_UPLOAD_DIR'] or os.path.join(current_app.instance_path, 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+    sha = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(dir=upload_dir)
+    with os.fdopen(fd, 'wb') as f:
+        # copy in chunks while hashing, so a large upload never sits in memory all at once
+        for chunk in iter(lambda: form_picture.stream.read(CHUNK_SIZE), b''):
+            size += len(chunk)
+            if size > config['PICTURE_MAX_BYTES']:
+                f.close()
+                os.remove(path)
+                raise InvalidPicture('That picture is too large.')
+            sha.update(chunk)
+            f.write(chunk)
+    from PIL import Image
+    try:
+        with Image.open(path) as i:    # only reads the header; the pixels are decoded later in the pool
+            image_format, (width, height) = i.format, i.size
+    except (OSError, Image.DecompressionBombError):
+        image_format, width, height = None, 0, 0
+    if image_format not in FORMATS:
+        os.remove(path)
+        raise InvalidPicture('That file is not a JPG or PNG picture.')
+    if width * height > config['PICTURE_MAX_PIXELS']:
+        os.remove(path)
+        raise InvalidPicture('That picture has too many pixels.')
+    return StagedPicture(path, sha.hexdigest(), FORMATS[image_format])
+
+def save_picture(picture, user_id):
+    # resizes the staged picture in the background, then swaps it in as the user's picture
+    picture_dir = os.path.join(current_app.root_path, 'static/profile_pics')
+    # asks the disk rather than _known_variants: another worker may have collected the files since we cached the name
+    if _variants_on_disk(picture.filename):
+        _known_variants.add(picture.filename)
+        os.remove(picture.path)     # somebody already uploaded this exact picture
+        finish_picture(user_id, picture.filename)
+        return
+    app = current_app._get_current_object()
+    future = _get_pool(app).submit(render_variants, picture.path, picture_dir, picture.filename,
+                                   app.config['PICTURE_SIZES'])
+
+    def done(future):
+        # runs on a pool helper thread once the resizing is done, so it needs its own app context
+        if future.exception():
+            log.error('Could not process picture %s: %s', picture.filename, future.exception())
+            return
+        with app.app_context():
+            finish_picture(user_id, picture.filename)
+    future.add_done_callback(done)
+
+def render_variants(src_path, picture_dir, filename, sizes):
+    # runs inside the process pool; keep it free of Flask so it can be pickled and run anywhere
+    from PIL import Image
+    stem, ext = os.path.splitext(filename)
+    try:
+        with Image.open(src_path) as original:
+            original.load()
+            # the plain <hash>.<ext> file is the classic 125px picture
+            _thumbnail(original, 125, ext).save(os.path.join(picture_dir, filename))
+            for size in sizes:  # the largest WebP is written last and marks the picture as complete
+                i = _thumbnail(original, size, ext)
+                i.save(os.path.join(picture_dir, f'{stem}_{size}{ext}'))
+                i.save(os.path.join(picture_dir, f'{stem}_{size}.webp'), 'WEBP')
+    finally:
+        os.remove(src_path)
+
+def _thumbnail(original, size, ext):
+    i = original.copy()
+    i.thumbnail((size, size))
+    if ext == '.jpg' and i.mode != 'RGB':
+        i = i.convert('RGB')    # JPEG has no alpha or palette modes
+    return i
+
+def finish_picture(user_id, filename):
+    from flaskblog import db
+    from flaskblog.models import User
+    from flaskblog.cache import invalidate_author
+    from flaskblog.users import identity
+    user = User.query.get(user_id)
+    old_filename = user.image_file
+    user.image_file = filename
+    user.touch_posts()
+    db.session.commit()
+    identity.forget(user_id)
+    invalidate_author(user)
+    if old_filename != filename:
+        collect_picture(old_filename)
+
+def collect_picture(filename):
+    # deletes a picture nobody uses anymore, along with its resized variants
+    from flaskblog.models import User
+    if filename == 'default.jpg' or User.query.filter_by(image_file=filename).first():
+        return
+    picture_dir = os.path.join(current_app.root_path, 'static/profile_pics')
+    stem, _ = os.path.splitext(filename)
+    _known_variants.discard(filename)
+    for path in [os.path.join(picture_dir, filename)] + glob.glob(os.path.join(picture_dir, stem + '_*')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _get_pool(app):
+    global _pool
+    if _pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn rather than fork, since the web server process is multithreaded
+        _pool = ProcessPoolExecutor(max_workers=app.config['PICTURE_WORKERS'],
+                                    mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def _has_variants(filename):
+    # pictures uploaded before the pipeline existed only have the single 125px file; for rendering we remember
+    # the names we have seen variants for, which is safe because a picture is only collected once no user has it
+    # (save_picture asks the disk instead, since a collected picture can be uploaded again)
+    if filename in _known_variants:
+        return True
+    if _variants_on_disk(filename):
+        _known_variants.add(filename)
+        return True
+    return False
+
+def _variants_on_disk(filename):
+    stem, _ = os.path.splitext(filename)
+    largest = current_app.config['PICTURE_SIZES'][-1]
+    return os.path.exists(os.path.join(current_app.root_path, 'static/profile_pics', f'{stem}_{largest}.webp'))
+
+def picture_url(filename, size, image_format=None):
+    # url of the stored size closest to what the template displays, falling back to the original file
+    if not _has_variants(filename):
+        return url_for('static', filename='profile_pics/' + filename)
+    stem, ext = os.path.splitext(filename)
+    return url_for('static', filename=f'profile_pics/{stem}_{size}.{image_format or ext[1:]}')
+
+def picture_srcset(filename, size, image_format=None):
+    # "<1x url> 1x, <2x url> 2x" for high density screens, or '' when the picture has no variants
+    if not _has_variants(filename):
+        return ''
+    return f'{picture_url(filename, size, image_format)} 1x, {picture_url(filename, size * 2, image_format)} 2x'
+
+def _cache_forever(response):
+    # a picture's name is a hash of its content (or random hex, for older ones), so a given URL never changes;
+    # browsers and proxies may keep it for a year without revalidating. default.jpg is the one shared, reusable name
+    filename = (request.view_args or {}).get('filename', '')
+    if (request.endpoint == 'static' and response.status_code == 200
+            and filename.startswith('profile_pics/') and not filename.endswith('/default.jpg')):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['PROFILE_PICTURE_MAX_AGE']
+        response.cache_control.immutable = True
+    return response
+
+def init_app(app):
+    app.add_template_global(picture_url)
+    app.add_template_global(picture_srcset)
+    app.after_request(_cache_forever)
@@ -1,14 +1,21 @@
 from flask import render_template, url_for, flash, redirect, request, Blueprint
 from flask_login import login_user, current_user, logout_user, login_required
-from flaskblog import db, bcrypt
+from flaskblog import db, hasher, cache, limiter
+from flaskblog.cache import invalidate_author
+from flaskblog.mailqueue import MailQueueFull
 from flaskblog.models import User, Post   # we place this here so that db is already defined when we run through model
 from flaskblog.users.forms import RegistrationForm, LoginForm, UpdateAccountForm, RequestResetForm, ResetPasswordForm
-from flaskblog.users.utils import save_picture, send_reset_email
+from flaskblog.users.utils import send_reset_email
+from flaskblog.users.pictures import stage_picture, save_picture, InvalidPicture
+from flaskblog.users import identity
+from flaskblog.pagination import paginate_feed, feed_state
+from flaskblog.database import read_only
 
 users = Blueprint('users', __name__)
 
 # we're creating routes specifically for the users blueprint
 @users.route("/register", methods=['GET', 'POST']) # list specifying allowed methods
+@limiter.limit  # too many sign-ups from one address get a 429 before we hash anything
 # @ decorators modify the functions that follow, and associate the URLs with the function
 def register():
     #register() is a view function - mapped to a route url so Flask knows what logic to execute when a webpage is requested
@@ -16,8 +23,8 @@ def register():
         return redirect(url_for('main.home'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
-        # .decode('utf-8') makes it a string instead of bytes
+        hashed_password = hasher.hash(form.password.data)
+        # hashes on the bcrypt thread pool and returns a string instead of bytes
         user = User(username=form.username.data, email=form.email.data, password=hashed_password)
         db.session.add(user)    # these two lines add a user to the database
         db.session.commit()
@@ -28,6 +35,7 @@ def register():
     return render_template('register.html', title='Register', form=form)
 
 @users.route("/login", methods=['GET', 'POST'])   # POST is more secure; cannot be seen, even without being encrypted
+@limiter.limit  # per address and per account, see RATELIMITS in config.py
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('main.home'))
@@ -38,8 +46,12 @@ def login():
         # return redirect(url_for('home'))
     # else:
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if user and hasher.check(user.password, form.password.data):
         # compares user.password (from the database) to form.password.data (user input password)
+            if hasher.needs_rehash(user.password):
+                # the hash was made with an older BCRYPT_LOG_ROUNDS; we have the plain password right now, so upgrade it
+                user.password = hasher.hash(form.password.data)
+                db.session.commit()
             login_user(user, remember=form.remember.data)   # remember is a True/False value (checkbox)
             next_page = request.args.get('next')    # args is a dictionary; using the get method will return None if the next parameter doesn't exist
             # request.args attribute exposes the contents of the query string in a friendly dictionary format
@@ -59,12 +71,24 @@ def logout():
 def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():
+        user = User.query.get(current_user.id)  # current_user is a cached read-only snapshot, so edit the real row
+        old_username = user.username
+        picture = None
         if form.picture.data:
-            picture_file = save_picture(form.picture.data)
-            current_user.image_file = picture_file
-        current_user.username = form.username.data
-        current_user.email = form.email.data
+            try:
+                picture = stage_picture(form.picture.data)  # saves and checks the upload, resizing happens later
+            except InvalidPicture as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('users.account'))
+        user.username = form.username.data
+        user.email = form.email.data
+        if user.username != old_username:
+            user.touch_posts()
         db.session.commit()
+        identity.forget(user.id)
+        invalidate_author(user, old_username)   # their name and picture appear on cached pages
+        if picture:
+            save_picture(picture, user.id)  # swaps in the new picture once the process pool has resized it
         flash('Your account has been updated!', 'success')
         return redirect(url_for('users.account'))
         # you want to use redirect instead of letting it fall down to the render template line
@@ -72,28 +96,37 @@ def account():
     elif request.method == 'GET':
         form.username.data = current_user.username
         form.email.data = current_user.email
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    # image_file defined in the User model, line 14 of models.py
+    image_file = current_user.image_file
+    # image_file defined in the User model, line 14 of models.py; account.html picks the right size of it
     return render_template('account.html', title='Account', image_file=image_file, form=form)
 
+def user_state(username):
+    user_id = db.session.query(User.id).filter_by(username=username).scalar()
+    return None if user_id is None else feed_state(f'user:{user_id}')
+
 @users.route("/user/<string:username>")
+@read_only
+@cache.conditional(user_state)
+@cache.cached_page('user:{username}')
 def user_posts(username):
-    page = request.args.get('page', 1, type=int)
     user = User.query.filter_by(username=username).first_or_404()
     # get the first user with this username or return 404; similar to GET method but doesn't search by id
-    posts = Post.query.filter_by(author=user)\
-        .order_by(Post.date_posted.desc())\
-        .paginate(page=page, per_page=5)
+    posts = paginate_feed(Post.listing_query().filter_by(user_id=user.id), f'user:{user.id}')
     return render_template('user_posts.html', posts=posts, user=user)
 
 @users.route("/reset_password", methods=['GET', 'POST'])
+@limiter.limit  # each allowed request can send an email
 def reset_request():
     if current_user.is_authenticated:
         return redirect(url_for('main.home'))
     form = RequestResetForm()
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        send_reset_email(user)
+        try:
+            send_reset_email(user)
+        except MailQueueFull:
+            flash('We are sending a lot of emails right now. Please try again in a few minutes.', 'warning')
+            return redirect(url_for('users.reset_request'))
         flash('An email has been sent with instructions to reset your password.', 'info')
         return redirect(url_for('users.login'))
     return render_template('reset_request.html', title='Reset Password', form=form)
@@ -108,9 +141,10 @@ def reset_token(token):
         return redirect(url_for('users.reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        hashed_password = hasher.hash(form.password.data)
         user.password = hashed_password
         db.session.commit()
+        identity.forget(user.id)
         flash('Your password has been updated! You are now able to log in', 'success')
         return redirect(url_for('users.login'))
     return render_template('reset_token.html', title='Reset Password', form=form)
\ No newline at end of file
@@ -1,25 +1,6 @@
-import os
-import secrets
-from PIL import Image
-from flask import url_for, current_app
+from flask import url_for
 from flask_mail import Message
-from flaskblog import mail
-
-def save_picture(form_picture):
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    # we are splitting the ext (file type) from the file name (f_name)
-    # we can store the filename in the _ variable that we will NOT use
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(current_app.root_path, 'static/profile_pics', picture_fn)
-    # current_app.root.path gives us the full path up to the package directory
-
-    output_size = (125, 125)    # tuple specifying dimension in px
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
-
-    return picture_fn
+from flaskblog import mail_queue
 
 # _external=True gives us an absolute URL rather than a relative URL
 def send_reset_email(user):
@@ -30,4 +11,5 @@ def send_reset_email(user):
 
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
-    mail.send(msg)
\ No newline at end of file
+    mail_queue.enqueue(msg)
+    # only queues the message; a background worker does the SMTP round-trip so this request returns right away
\ No newline at end of file
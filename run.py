@@ -5,5 +5,6 @@ app = create_app()
 if __name__ == '__main__':
     # this conditional is only true if we run the script with python directly;
     # if we import the module to somewhere else, the name will be the name of the module
+    # this is Werkzeug's development server; in production use `gunicorn run:app` or `uvicorn asgi:app` (see asgi.py)
     app.run(debug=True)
 